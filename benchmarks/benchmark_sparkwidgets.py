@@ -0,0 +1,474 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Headless benchmarks for urwid-sparkwidgets.
+
+Times widget construction, palette generation and rendering without a
+terminal.  Results can be saved as JSON and compared against an earlier run:
+
+    python benchmarks/benchmark_sparkwidgets.py -o before.json
+    ... make changes ...
+    python benchmarks/benchmark_sparkwidgets.py -c before.json
+
+Render caching is disabled while timing so that every iteration does the full
+amount of work; the "cached" cases measure the cache itself.  The "import"
+cases time a fresh interpreter importing the package (and urwid alone, for
+reference).  The memory held by one rendered sparkline is reported after the
+timings.
+"""
+
+import argparse
+import array
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import urwid
+import urwid_sparkwidgets as sw
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SERIES_LENGTHS = [100, 1000, 10000]
+BAR_LENGTHS = [10, 100, 1000]
+COLUMN_SCHEMES = ["mono", "rotate_16", "signed"]
+RENDER_WIDTH = 80
+MEMORY_WIDGETS = 100
+SCREEN_WIDGETS = 500
+HEADLESS_SERIES = 2000
+BUFFER_LENGTH = 1000000
+HISTOGRAM_BATCH = 100000
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def series(n, seed=0):
+    rnd = random.Random(seed)
+    return [ rnd.uniform(-10, 100) for i in range(n) ]
+
+
+def uncached(fn):
+    def run():
+        cache = sw.SparkWidget.render_cache
+        sw.SparkWidget.render_cache = None
+        try:
+            return fn()
+        finally:
+            sw.SparkWidget.render_cache = cache
+    return run
+
+
+def instrumented(fn):
+    def run():
+        sw.enable_stats()
+        try:
+            return fn()
+        finally:
+            sw.disable_stats()
+    return run
+
+
+def register_column_benchmarks():
+
+    for scheme in COLUMN_SCHEMES:
+        for n in SERIES_LENGTHS:
+            data = series(n)
+
+            @benchmark("column/construct/%s/%d" %(scheme, n))
+            def setup(data=data, scheme=scheme):
+                return uncached(
+                    lambda: sw.SparkColumnWidget(data, color_scheme=scheme)
+                )
+
+            if np is not None:
+                values = np.array(data)
+
+                @benchmark("column/construct_ndarray/%s/%d" %(scheme, n))
+                def setup(values=values, scheme=scheme):
+                    return uncached(
+                        lambda: sw.SparkColumnWidget(values, color_scheme=scheme)
+                    )
+
+    for scale in ["linear", "log", "symlog"]:
+        data = [ abs(v) + 1 for v in series(1000) ]
+
+        @benchmark("column/construct_scale/%s/1000" %(scale))
+        def setup(data=data, scale=scale):
+            return uncached(lambda: sw.SparkColumnWidget(data, scale=scale))
+
+    for n in SERIES_LENGTHS:
+        data = series(n)
+
+        @benchmark("column/append/%d" %(n))
+        def setup(data=data, n=n):
+            widget = sw.SparkColumnWidget(data, max_length=n)
+            samples = iter(series(1000000, seed=1))
+            return uncached(lambda: widget.append(next(samples)))
+
+        @benchmark("column/append_instrumented/%d" %(n))
+        def setup(data=data, n=n):
+            widget = sw.SparkColumnWidget(data, max_length=n)
+            samples = iter(series(1000000, seed=1))
+            return uncached(instrumented(lambda: widget.append(next(samples))))
+
+        @benchmark("column/scroll_render/%d" %(n))
+        def setup(data=data, n=n):
+            # one tick of a live chart: a sample in, the oldest out, redraw
+            widget = sw.SparkColumnWidget(data, max_length=n,
+                                          color_scheme="rotate_16",
+                                          scale_min=-10, scale_max=100)
+            samples = iter(series(1000000, seed=1))
+            def tick():
+                widget.append(next(samples))
+                return widget.render((max(n, RENDER_WIDTH),))
+            return uncached(tick)
+
+        @benchmark("column/render/%d" %(n))
+        def setup(data=data):
+            return uncached(
+                lambda: sw.SparkColumnWidget(data, reducer="mean").render((RENDER_WIDTH,))
+            )
+
+    screen = [ series(RENDER_WIDTH, seed=i) for i in range(SCREEN_WIDGETS) ]
+
+    @benchmark("column/render_screen/%d" %(SCREEN_WIDGETS))
+    def setup(screen=screen):
+        widgets = [ sw.SparkColumnWidget(data, color_scheme="rotate_16")
+                    for data in screen ]
+        def render():
+            for widget in widgets:
+                widget._invalidate()
+                widget.render((RENDER_WIDTH,))
+        return uncached(render)
+
+    shared = array.array("d", series(BUFFER_LENGTH))
+
+    @benchmark("column/update_window/list/%d" %(BUFFER_LENGTH))
+    def setup(shared=shared):
+        widget = sw.SparkColumnWidget([], color_scheme="rotate_16")
+        return uncached(
+            lambda: widget.update(list(shared)[-RENDER_WIDTH * 10:])
+        )
+
+    @benchmark("column/update_window/buffer/%d" %(BUFFER_LENGTH))
+    def setup(shared=shared):
+        widget = sw.SparkColumnWidget([], color_scheme="rotate_16")
+        return uncached(
+            lambda: widget.update(shared, BUFFER_LENGTH - RENDER_WIDTH * 10)
+        )
+
+    for style in sorted(sw.DOT_STYLES):
+        for n in SERIES_LENGTHS:
+            data = series(n)
+
+            @benchmark("dot/construct/%s/%d" %(style, n))
+            def setup(data=data, style=style):
+                return uncached(
+                    lambda: sw.SparkDotWidget(data, style=style,
+                                              color_scheme="rotate_16")
+                )
+
+            @benchmark("dot/render/%s/%d" %(style, n))
+            def setup(data=data, style=style):
+                return uncached(
+                    lambda: sw.SparkDotWidget(
+                        data, style=style, reducer="mean"
+                    ).render((RENDER_WIDTH,))
+                )
+
+    data = series(RENDER_WIDTH)
+
+    @benchmark("column/construct_render/cached")
+    def setup(data=data):
+        return lambda: sw.SparkColumnWidget(data).render((RENDER_WIDTH,))
+
+
+def register_histogram_benchmarks():
+
+    samples = [ abs(v) for v in series(1000000, seed=2) ]
+    modes = [
+        ("linear", {}),
+        ("log", {"bin_scale": "log"}),
+        ("decay", {"half_life": 1000}),
+        ("window", {"window_length": 10000})
+    ]
+
+    for name, options in modes:
+
+        @benchmark("histogram/append/%s" %(name))
+        def setup(options=options):
+            widget = sw.SparkHistogramWidget([], 1, 100, bins=64, **options)
+            values = itertools.cycle(samples)
+            return lambda: widget.append(next(values))
+
+        if np is not None:
+            batch = np.array(samples[:HISTOGRAM_BATCH])
+
+            @benchmark("histogram/extend/%s/%d" %(name, HISTOGRAM_BATCH))
+            def setup(options=options, batch=batch):
+                widget = sw.SparkHistogramWidget([], 1, 100, bins=64, **options)
+                return lambda: widget.extend(batch)
+
+    @benchmark("histogram/append_render/64")
+    def setup():
+        widget = sw.SparkHistogramWidget([], 1, 100, bins=64)
+        values = itertools.cycle(samples)
+        def tick():
+            widget.append(next(values))
+            return widget.render((RENDER_WIDTH,))
+        return uncached(tick)
+
+
+def register_bar_benchmarks():
+
+    for n in BAR_LENGTHS:
+        data = [ abs(v) + 1 for v in series(n) ]
+        labeled = [
+            (sw.DISTINCT_COLORS_TRUE[i % len(sw.DISTINCT_COLORS_TRUE)], v,
+             ("%d {value} ({pct}%%)" %(i), "black"))
+            for i, v in enumerate(data)
+        ]
+
+        @benchmark("bar/construct/rotate_true/%d" %(n))
+        def setup(data=data):
+            return uncached(
+                lambda: sw.SparkBarWidget(data, RENDER_WIDTH, color_scheme="rotate_true")
+            )
+
+        @benchmark("bar/construct/labeled/%d" %(n))
+        def setup(labeled=labeled):
+            return uncached(
+                lambda: sw.SparkBarWidget(labeled, RENDER_WIDTH, normalize=(1, 100))
+            )
+
+        @benchmark("bar/set_value/labeled/%d" %(n))
+        def setup(labeled=labeled, n=n):
+            widget = sw.SparkBarWidget(labeled, RENDER_WIDTH)
+            samples = iter(series(1000000, seed=1))
+            return uncached(
+                lambda: widget.set_value(n - 1, abs(next(samples)) + 1)
+            )
+
+        @benchmark("bar/render/%d" %(n))
+        def setup(data=data):
+            return uncached(
+                lambda: sw.SparkBarWidget(
+                    data, RENDER_WIDTH, color_scheme="rotate_true"
+                ).render((RENDER_WIDTH,))
+            )
+
+
+def register_palette_benchmarks():
+
+    @benchmark("palette/get_palette_entries/default")
+    def setup():
+        return sw.get_palette_entries
+
+    @benchmark("palette/get_palette_entries/16")
+    def setup():
+        return lambda: sw.get_palette_entries(chart_colors=sw.DISTINCT_COLORS_16)
+
+    colors = (sw.DISTINCT_COLORS_16
+              + sw.DISTINCT_COLORS_256
+              + sw.DISTINCT_COLORS_TRUE)
+
+    @benchmark("palette/get_label_color")
+    def setup():
+        return lambda: [ sw.get_label_color(c) for c in colors ]
+
+    for quantize in [None, 16, 256]:
+
+        @benchmark("palette/random_bar/%s" %(quantize or "unbounded"))
+        def setup(quantize=quantize):
+            # every bar brings new truecolor segments, as in the demo
+            rnd = random.Random(0)
+            registry = sw.PaletteRegistry()
+            quantizer = quantize and sw.ColorQuantizer(quantize)
+
+            def run():
+                items = [ ("#%06x" %(rnd.randrange(1 << 24)), rnd.randint(1, 50))
+                          for i in range(5) ]
+                sw.SparkWidget.palette_registry = registry
+                sw.SparkWidget.color_quantizer = quantizer
+                try:
+                    return sw.SparkBarWidget(items, RENDER_WIDTH)
+                finally:
+                    sw.SparkWidget.palette_registry = None
+                    sw.SparkWidget.color_quantizer = None
+            return uncached(run)
+
+
+def register_headless_benchmarks():
+
+    data = [ series(60, seed=i) for i in range(HEADLESS_SERIES) ]
+
+    for colors in [None, 256]:
+
+        @benchmark("headless/render_many/%s/%d" %(colors or "plain", HEADLESS_SERIES))
+        def setup(colors=colors):
+            return uncached(
+                lambda: sw.render_many(data, color_scheme="rotate_16",
+                                       colors=colors, processes=1)
+            )
+
+    @benchmark("headless/render_many/pool/%d" %(HEADLESS_SERIES))
+    def setup():
+        return uncached(
+            lambda: sw.render_many(data, color_scheme="rotate_16", colors=256)
+        )
+
+
+def register_import_benchmarks():
+
+    snippets = [
+        ("import/urwid", "import urwid"),
+        ("import/urwid_sparkwidgets", "import urwid_sparkwidgets"),
+        ("import/render_one",
+         "import urwid_sparkwidgets as sw; "
+         "sw.SparkColumnWidget(list(range(20))).render((20,))"),
+    ]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+
+    for name, code in snippets:
+
+        @benchmark(name)
+        def setup(code=code):
+            return lambda: subprocess.check_call([sys.executable, "-c", code], env=env)
+
+
+def run(pattern=None, repeat=5):
+
+    results = {}
+    for name, setup in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        fn = setup()
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number)) / number
+        results[name] = best
+        print("%-45s %12.3f us" %(name, best * 1e6))
+        sys.stdout.flush()
+    return results
+
+
+def measure_memory(pattern=None):
+
+    results = {}
+    for (scheme, compact, n) in itertools.product(
+            ["mono", "rotate_16"], [False, True], SERIES_LENGTHS[1:]):
+        name = "memory/column/%s/%s/%d" %(
+            "compact" if compact else "default", scheme, n
+        )
+        if pattern and pattern not in name:
+            continue
+        data = series(n)
+        tracemalloc.start()
+        widgets = [
+            sw.SparkColumnWidget(data, color_scheme=scheme,
+                                 max_length=n, compact=compact)
+            for i in range(MEMORY_WIDGETS)
+        ]
+        for widget in widgets:
+            widget.render((RENDER_WIDTH,))
+        size = tracemalloc.get_traced_memory()[0] / MEMORY_WIDGETS
+        tracemalloc.stop()
+        del widgets
+        results[name] = size
+        print("%-45s %12.1f KiB" %(name, size / 1024))
+        sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline):
+
+    print()
+    print("%-45s %12s %12s %8s" %("benchmark", "baseline", "current", "ratio"))
+    for name, current in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        print("%-45s %9.3f us %9.3f us %7.2fx" %(
+            name, before * 1e6, current * 1e6, before / current
+        ))
+
+
+def compare_memory(results, baseline):
+
+    if not results:
+        return
+    print()
+    print("%-45s %12s %12s %8s" %("memory", "baseline", "current", "ratio"))
+    for name, current in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        print("%-45s %8.1f KiB %8.1f KiB %7.2fx" %(
+            name, before / 1024, current / 1024, before / current
+        ))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("-c", "--compare", help="compare against a JSON results file")
+    parser.add_argument("-k", "--filter", help="only run benchmarks containing this string")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="timing repetitions per benchmark (best is kept)")
+    options = parser.parse_args()
+
+    register_column_benchmarks()
+    register_histogram_benchmarks()
+    register_bar_benchmarks()
+    register_palette_benchmarks()
+    register_headless_benchmarks()
+    register_import_benchmarks()
+
+    results = run(options.filter, options.repeat)
+    print()
+    memory = measure_memory(options.filter)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "urwid": urwid.__version__,
+                    "numpy": np.__version__ if np is not None else None
+                },
+                "results": results,
+                "memory": memory
+            }, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        compare(results, baseline["results"])
+        compare_memory(memory, baseline.get("memory", {}))
+
+
+if __name__ == "__main__":
+    main()
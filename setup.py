@@ -21,5 +21,8 @@ setup(name=name,
       data_files=[('share/doc/%s' % name, ['LICENSE','README.md']),
               ],
       install_requires = ['urwid',
-                          'urwid_utils']
+                          'urwid_utils'],
+      extras_require = {
+          'numpy': ['numpy']
+      }
      )
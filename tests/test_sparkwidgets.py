@@ -0,0 +1,930 @@
+import random
+import urwid
+
+from urwid_sparkwidgets import *
+
+
+def brute_force_filter(items, width):
+    # the original small-segment elimination loop from SparkBarWidget
+    filtered_items = [ i for i in items ]
+    while True:
+        values = [ i[1] if isinstance(i, tuple) else i
+                   for i in filtered_items ]
+        if not len(values):
+            return filtered_items
+        total = sum(values)
+        charwidth = total / width
+        try:
+            i = next(iter(filter(
+                lambda i: (i[1] if isinstance(i, tuple) else i) < charwidth,
+                filtered_items)))
+            filtered_items.remove(i)
+        except StopIteration:
+            return filtered_items
+
+
+def test_filter_items_matches_brute_force():
+
+    rnd = random.Random(0)
+    for _ in range(5000):
+        width = rnd.randint(1, 40)
+        items = [
+            rnd.choice([
+                rnd.randint(1, 100),
+                rnd.random() * 10,
+                ("dark red", rnd.randint(1, 100), "x"),
+            ])
+            for _ in range(rnd.randint(1, 30))
+        ]
+        assert (SparkBarWidget.filter_items(items, width)
+                == brute_force_filter(items, width))
+
+    # magnitudes far apart, where a running total picks up rounding error
+    items = [0.5, 1e12 + 0.1, 0.3]
+    assert SparkBarWidget.filter_items(items, 1) == brute_force_filter(items, 1) == [0.3]
+    assert SparkBarWidget(items, 1, color_scheme="rotate_16").sparktext
+    for _ in range(5000):
+        width = rnd.randint(1, 3)
+        items = [
+            rnd.choice([
+                10 ** rnd.uniform(0, 16),
+                rnd.uniform(-1, 1) * 10 ** rnd.uniform(0, 16),
+                ("dark red", 10 ** rnd.uniform(0, 16), "x"),
+            ])
+            for _ in range(rnd.randint(1, 12))
+        ]
+        assert (SparkBarWidget.filter_items(items, width)
+                == brute_force_filter(items, width))
+
+
+def test_filter_items_negative_values():
+
+    rnd = random.Random(1)
+    for _ in range(2000):
+        width = rnd.randint(1, 10)
+        items = [ rnd.randint(-20, 50) for _ in range(rnd.randint(1, 10)) ]
+        assert (SparkBarWidget.filter_items(items, width)
+                == brute_force_filter(items, width))
+
+
+def original_rule_function(scheme):
+    # the rule closure SparkWidget built for "rules" color schemes
+    def rule_function(value):
+        return scheme["colors"].get(
+            next(iter(filter(
+                lambda rule: OPERATOR_MAP[rule[0]](
+                    value, rule[1] if len(rule) > 1 else None),
+                scheme["rules"]
+            )))[-1]
+        )
+    return rule_function
+
+
+def test_rules_match_original():
+
+    import math
+
+    rnd = random.Random(12)
+    thresholds = [ -5, 0, 0.5, 3, 2 ** 53, 2 ** 53 + 2, 1e17, -1e300, 1e300 ]
+    schemes = [
+        COLOR_SCHEMES["signed"],
+        { "colors": { "a": "a", "b": "b" },
+          "rules": [ ("<", 1e17, "a"), ("else", "b") ] }
+    ]
+    for _ in range(300):
+        rules = [
+            (rnd.choice([ "<", "<=", ">", ">=", "=" ]), rnd.choice(thresholds),
+             rnd.choice("abcd"))
+            for _ in range(rnd.randint(1, 5))
+        ] + [ ("else", "e") ]
+        schemes.append({ "colors": { k: k for k in "abcde" }, "rules": rules })
+
+    values = [ math.nan, -math.inf, math.inf, 1e16, -1e16 ]
+    for t in thresholds:
+        values += [ t, math.nextafter(t, -math.inf), math.nextafter(t, math.inf),
+                    t - 1, t + 1, t * 2 ]
+    values += [ rnd.uniform(-10, 10) for _ in range(50) ]
+
+    for scheme in schemes:
+        table = compile_rules(scheme)
+        expected = [ original_rule_function(scheme)(v) for v in values ]
+        assert [ table(v) for v in values ] == expected
+        if load_numpy() is not None:
+            import numpy
+            # the array holds the values rounded to floats
+            array = numpy.array(values, dtype=float)
+            assert (table.classify(array).tolist()
+                    == [ original_rule_function(scheme)(v) for v in array.tolist() ])
+
+
+def test_rolling_min_max():
+
+    rnd = random.Random(13)
+    options = dict(underline="min", overline="max", color_scheme="signed")
+    items = [ rnd.uniform(-50, 50) for i in range(20) ]
+    widget = SparkColumnWidget(items, max_length=20, **options)
+    for i in range(300):
+        if i % 3:
+            new = [ rnd.uniform(-50, 50) ]
+            widget.append(new[0])
+        else:
+            # monotonic runs keep evicting the current min or max
+            start = rnd.uniform(-50, 50)
+            new = [ start + k * rnd.choice([-1, 1]) for k in range(rnd.randint(1, 25)) ]
+            widget.extend(new)
+        items.extend(new)
+        window = items[-20:]
+        assert (widget.v_min, widget.v_max) == (min(window), max(window))
+        expected = SparkColumnWidget(window, **options)
+        assert widget.get_bounds() == expected.get_bounds()
+        assert widget.text == expected.text
+
+def test_vectorized_matches_scalar(monkeypatch):
+
+    import urwid_sparkwidgets
+
+    numpy = load_numpy()
+    if numpy is None:
+        return
+    rnd = random.Random(14)
+    values = [ rnd.uniform(-20, 100) for i in range(300) ]
+    values[50] = values[120] = max(values)
+    for options in [
+            dict(color_scheme="rotate_16"),
+            dict(color_scheme="signed", underline="negative", height=3),
+            dict(underline="min", overline="max", scale_min=0, scale_max=50),
+            dict(color_scheme="signed", scale="symlog", compact=True)]:
+        vectorized = SparkColumnWidget(numpy.array(values), **options).text
+        assert SparkColumnWidget(values, **options).text == vectorized
+        monkeypatch.setattr(urwid_sparkwidgets, "VECTORIZE_THRESHOLD", 10 ** 9)
+        assert SparkColumnWidget(values, **options).text == vectorized
+        monkeypatch.undo()
+
+def test_markup_coalesced():
+
+    rnd = random.Random(15)
+    values = [ rnd.uniform(0, 100) for i in range(200) ]
+    for compact in [False, True]:
+        widget = SparkColumnWidget(values, compact=compact)
+        assert widget.render((200,))._attr == [[(None, 600)]]
+        assert len(widget.sparktext) == 1
+        assert len(widget.sparktext[0]) == 200
+
+    values = [ rnd.uniform(-100, 100) for i in range(200) ]
+    widget = SparkColumnWidget(values, color_scheme="signed")
+    signs = [ v < 0 for v in values ]
+    assert len(widget.sparktext) == 1 + sum(
+        a != b for a, b in zip(signs, signs[1:])
+    )
+    assert (SparkWidget.coalesce([ ("a", "x"), ("a", "y"), (None, "z"), ("b", "w") ])
+            == [ ("a", "xy"), "z", ("b", "w") ])
+
+def test_reducers():
+
+    import math
+
+    numpy = load_numpy()
+    rnd = random.Random(16)
+    for n in [10, 101, 1000]:
+        values = [ rnd.uniform(-100, 100) for i in range(n) ]
+        for width in [1, 2, 3, 7, 50, n - 1]:
+            if width >= n:
+                continue
+            for name, reducer in REDUCERS.items():
+                (reduced, idx) = reducer(values, width)
+                assert len(reduced) == len(idx) <= width, (name, n, width)
+                assert all(0 <= i < n for i in idx)
+                if reducer is not reduce_mean and not (
+                        reducer is reduce_lttb and width < 3):
+                    # picked values, rather than means of buckets
+                    assert reduced == [ values[i] for i in idx ]
+                if numpy is None:
+                    continue
+                (array_reduced, array_idx) = reducer(numpy.array(values), width)
+                assert list(array_idx) == list(idx), (name, n, width)
+                assert all(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+                           for a, b in zip(array_reduced, reduced))
+                assert len(array_reduced) == len(reduced)
+
+    if numpy is not None:
+        for name in REDUCERS:
+            widget = SparkColumnWidget(values, reducer=name, color_scheme="signed")
+            canvas = widget.render((40,))
+            assert canvas.cols() == 40
+            assert (list(canvas.content()) == list(SparkColumnWidget(
+                numpy.array(values), reducer=name, color_scheme="signed"
+            ).render((40,)).content()))
+
+def test_bar_output_unchanged():
+
+    assert SparkBarWidget(
+        [5, 44, 22, 43, 30, 22, 42], 3, color_scheme="rotate_16"
+    ).sparktext == [
+        ("dark red:dark red", " "),
+        ("dark red:dark green", "\N{LEFT ONE EIGHTH BLOCK}"),
+        ("dark green:dark green", " ")
+    ]
+
+    assert SparkBarWidget(
+        [1, 1, 50, 2, 60, 1, 3, 70], 10, color_scheme="rotate_16"
+    ).sparktext == [
+        ("dark red:dark red", "   "),
+        ("dark green:dark green", "   "),
+        ("dark green:brown", "\N{LEFT ONE EIGHTH BLOCK}"),
+        ("brown:brown", "   ")
+    ]
+
+    assert SparkBarWidget([
+        ("light red", 19, "foo"),
+        ("light green", 42, "bar"),
+        ("light blue", 17, "baz"),
+        ("dark red", 1, "x")
+    ], 20).sparktext == [
+        ("light gray:light red", "foo  "),
+        ("light gray:light green", "bar        "),
+        ("light gray:light blue", "baz ")
+    ]
+
+
+def attrspec_label_color(color, dark, light):
+    # the original AttrSpec-based get_label_color
+    (r, g, b) = urwid.AttrSpec(color, color).get_rgb_values()[:3]
+    colors = [r / 255, g / 255, b / 255]
+    c = [ (c / 12.92)
+          if c < 0.03928
+          else ((c + 0.055) / 1.055)**2.4
+          for c in colors ]
+    L = 0.2126 * c[0] + 0.7152 * c[1] + 0.0722 * c[2]
+    return dark if L > 0.179 else light
+
+
+def test_label_color_matches_attrspec():
+
+    rnd = random.Random(0)
+    colors = (
+        urwid.display_common._BASIC_COLORS
+        + [ "h%d" %(i) for i in range(256) ]
+        + [ "g%d" %(i) for i in range(101) ]
+        + [ "#%03x" %(rnd.randrange(1 << 12)) for i in range(500) ]
+        + [ "#%06x" %(rnd.randrange(1 << 24)) for i in range(2000) ]
+        + DISTINCT_COLORS_256
+        + DISTINCT_COLORS_TRUE
+    )
+    for color in colors:
+        assert (get_label_color(color, "dark", "light")
+                == attrspec_label_color(color, "dark", "light"))
+
+
+def test_compact_matches_default():
+
+    rnd = random.Random(2)
+    for scheme in ["mono", "rotate_16", "signed"]:
+        items = [ rnd.uniform(-10, 100) for i in range(200) ] + [ ("light red", 5) ]
+        default = SparkColumnWidget(items, color_scheme=scheme, max_length=150,
+                                    underline="min", reducer="mean")
+        compact = SparkColumnWidget(items, color_scheme=scheme, max_length=150,
+                                    underline="min", reducer="mean", compact=True)
+        for i in range(20):
+            item = rnd.uniform(-20, 120)
+            default.append(item)
+            compact.append(item)
+        for size in [(40,), (400,)]:
+            assert (list(default.render(size).content())
+                    == list(compact.render(size).content()))
+        assert default.text == compact.text
+
+
+
+def test_quantization_scales():
+
+    decades = [ 10 ** k for k in range(8) ]
+    assert (SparkColumnWidget(decades, scale="log", scale_min=1,
+                              scale_max=10 ** 7).text
+            == "\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588")
+
+    symmetric = [ -1000, -100, -10, -1, 0, 1, 10, 100, 1000 ]
+    table = QuantizationTable("symlog", -1000, 1000, 8)
+    assert [ table.index(v) for v in symmetric ] == [0, 1, 2, 3, 4, 4, 5, 6, 7]
+    assert (SparkColumnWidget(symmetric, scale="symlog", scale_min=-1000,
+                              scale_max=1000).text
+            == "\u2581\u2582\u2583\u2584\u2585\u2585\u2586\u2587\u2588")
+
+    # a flipped linear scale is drawn upside down, flipped log scales flat
+    assert (SparkColumnWidget(list(range(8)), scale_min=7, scale_max=0).text
+            == "\u2588\u2587\u2586\u2585\u2584\u2583\u2582\u2581")
+    for scale in ["log", "symlog"]:
+        assert (SparkColumnWidget(list(range(1, 9)), scale=scale,
+                                  scale_min=8, scale_max=1).text
+                == "\u2581" * 8)
+
+    # log scales without positive bounds fall back to symlog
+    for scale_min in [0, -5]:
+        fallback = QuantizationTable("log", scale_min, 50, 8)
+        assert fallback.edges == QuantizationTable("symlog", scale_min, 50, 8).edges
+        assert fallback.index(-5) == 0
+
+    rnd = random.Random(10)
+    for (scale, scale_min, scale_max) in [
+            ("log", 0.5, 5000), ("log", 1, 1e9), ("symlog", -50, 5000),
+            ("symlog", -1e6, 1e6), ("log", -1, 100)]:
+        table = QuantizationTable(scale, scale_min, scale_max, 24)
+        values = [ rnd.uniform(scale_min, scale_max) for i in range(500) ]
+        values += [ e for e in table.edges[1:] ] + [ scale_min, scale_max, 0 ]
+        values += [ 10 ** rnd.uniform(-1, 9) for i in range(200) ]
+        scalar = [ table.index(v) for v in values ]
+        assert min(scalar) >= 0 and max(scalar) <= 23
+        if load_numpy() is not None:
+            import numpy
+            assert table.indexes(numpy.array(values)).tolist() == scalar
+
+
+def test_spark_group(monkeypatch):
+
+    rnd = random.Random(11)
+    for options in [
+            dict(color_scheme="rotate_16", underline="min", overline="max"),
+            dict(color_scheme="signed", compact=True),
+            dict(color_scheme="rotate_16", height=2, max_length=40)]:
+        series = [ [ rnd.uniform(-10, 100) for i in range(n) ]
+                   for n in [30, 80, 5] ]
+        group = SparkGroup(series, **options)
+
+        def check():
+            (scale_min, scale_max) = group.get_scale()
+            assert group.scale == (scale_min, scale_max)
+            for row, items in zip(group.sparks, series):
+                expected = SparkColumnWidget(items, scale_min=scale_min,
+                                             scale_max=scale_max, **options)
+                assert row.text == expected.text
+                assert row.render((60,)).text == expected.render((60,)).text
+
+        check()
+
+        # a new global max rescales every row
+        scale = group.scale
+        series[2].append(200)
+        group.append(2, 200)
+        assert group.scale != scale
+        check()
+
+        # items within the scale only refresh the rows they are added to
+        refreshed = []
+        requantized = []
+        refresh = SparkColumnWidget._refresh
+        monkeypatch.setattr(
+            SparkColumnWidget, "_refresh",
+            lambda self: refreshed.append(self) or refresh(self)
+        )
+        monkeypatch.setattr(
+            SparkColumnWidget, "_requantize",
+            lambda self, *args: requantized.append(self)
+        )
+        items = [ rnd.uniform(0, 90) for i in range(10) ]
+        series[0].extend(items[:5])
+        series[1].extend(items[5:])
+        group.update({0: items[:5], 1: items[5:]})
+        assert not requantized
+        assert [ id(row) for row in refreshed ] == [ id(row) for row in group.sparks[:2] ]
+        monkeypatch.undo()
+        check()
+
+    # the group's rows live in sparks, leaving Pile.rows() to report its height
+    group = SparkGroup([[1, 2, 3], [4, 5, 6]], color_scheme="rotate_16", height=2)
+    assert group.rows((20,)) == 4
+    pile = urwid.Pile([group, urwid.Text("x")])
+    assert pile.rows((20,)) == 5
+    assert pile.render((20,)).rows() == 5
+
+
+class StubScreen(object):
+
+    def __init__(self):
+        self.entries = []
+
+    def register_palette_entry(self, *entry):
+        self.entries.append(entry)
+
+
+def test_palette_registry(monkeypatch):
+
+    registry = PaletteRegistry()
+    monkeypatch.setattr(SparkWidget, "palette_registry", registry)
+
+    for i in range(3):
+        SparkColumnWidget([ -3, -1, 0, 2, 5 ], color_scheme="signed")
+        SparkBarWidget([ 3, 4, 5 ], 20, color_scheme="rotate_16")
+    SparkColumnWidget([ ("my attr", 3), ("light red", 4) ])
+
+    # "default" from the signed scheme and user attributes aren't colors
+    assert registry.ignored == { "default", "my attr" }
+    assert "dark red" in registry.attributes
+    assert "light red" in registry.attributes
+    assert not registry.attributes & registry.ignored
+    assert registry.attributes == set(registry.entries)
+
+    # nothing is registered until there is a screen, then everything once
+    screen = StubScreen()
+    registry.attach(screen)
+    assert [ entry[0] for entry in screen.entries ] == list(registry.entries)
+    assert screen.entries == [ tuple(get_palette_entry(attr))
+                               for attr in registry.entries ]
+
+    # widgets repeating known attributes register nothing new
+    SparkColumnWidget([ -3, -1, 0, 2, 5 ], color_scheme="signed")
+    SparkBarWidget([ 3, 4, 5 ], 20, color_scheme="rotate_16")
+    assert len(screen.entries) == len(registry.attributes)
+    SparkColumnWidget([ ("dark cyan", 1) ])
+    assert screen.entries[-1] == tuple(get_palette_entry("dark cyan"))
+    assert len(screen.entries) == len(registry.attributes)
+
+
+def test_palette_registry_screen(monkeypatch):
+
+    screen = urwid.display.raw.Screen()
+    registry = PaletteRegistry(screen)
+    monkeypatch.setattr(SparkWidget, "palette_registry", registry)
+
+    SparkColumnWidget([ -3, -1, 0, 2, 5 ], color_scheme="signed")
+    SparkColumnWidget([ ("#ff0000", 1), ("h200", 2), ("light gray:#ff0000", 3) ])
+    for scheme in [ "rotate_16", "rotate_256", "rotate_true" ]:
+        SparkBarWidget([ 3, 4, 5, 6 ], 20, color_scheme=scheme)
+    assert len(registry.attributes) > 10
+    assert registry.ignored == { "default" }
+    for attr in registry.attributes:
+        assert attr in screen._palette
+
+    # entries built up front register too
+    for entry in get_palette_entries(chart_colors=[ "dark red", "#ff8800" ]).values():
+        screen.register_palette_entry(*entry)
+
+
+def test_compact_attribute_table():
+
+    # more distinct colors than 16-bit attribute ids, through a short window
+    items = [ ("#%06x" %(i * 97), i % 50) for i in range(70000) ]
+    compact = SparkColumnWidget([], max_length=10, compact=True)
+    for item in items:
+        compact.append(item)
+    assert len(compact._attrs) <= COMPACT_ATTR_LIMIT + 1
+    assert compact.text == SparkColumnWidget(items[-10:]).text
+
+    unbounded = SparkColumnWidget(items, compact=True)
+    assert unbounded.text == SparkColumnWidget(items).text
+
+
+def test_canvas_matches_text_layout():
+
+    rnd = random.Random(3)
+    items = [ rnd.uniform(-10, 100) for i in range(30) ] + [ ("light red", 5) ]
+    widgets = [
+        SparkColumnWidget(items, color_scheme="rotate_16", underline="min",
+                          overline="max", align=align, height=height)
+        for align in ["left", "center", "right"]
+        for height in [1, 3]
+    ] + [
+        SparkColumnWidget(items, underline="negative", reducer="minmax"),
+        SparkBarWidget([5, 44, 22, 43], 20, color_scheme="rotate_16",
+                       align="center")
+    ]
+    for widget in widgets:
+        for size in [(12,), (40,)]:
+            markup = widget.get_markup(size)
+            expected = urwid.Text(markup, align=widget.align).render(size)
+            canvas = widget.render(size)
+            assert list(canvas.content()) == list(expected.content())
+            assert widget.rows(size) == expected.rows()
+
+
+def test_bar_updates_match_rebuild():
+
+    rnd = random.Random(4)
+    items = [
+        ("light red", 19, "foo {pct}%"),
+        ("light green", 42, ("bar {value}", "black")),
+        ("light blue", 17, "baz"),
+        ("dark red", 1, "x")
+    ]
+    widget = SparkBarWidget(items, 30)
+    for i in range(200):
+        index = rnd.randrange(len(items))
+        value = rnd.randint(1, 50)
+        widget.set_value(index, value)
+        items[index] = items[index][:1] + (value,) + items[index][2:]
+        assert widget.sparktext == SparkBarWidget(items, 30).sparktext
+
+    items = [ rnd.randint(1, 50) for i in range(8) ]
+    widget = SparkBarWidget(items, 20, color_scheme="rotate_16")
+    for i in range(200):
+        # swapping two values keeps the total, so the layout is resumed
+        a, b = rnd.randrange(8), rnd.randrange(8)
+        items[a], items[b] = items[b], items[a]
+        widget.update(items)
+        assert (widget.sparktext
+                == SparkBarWidget(items, 20, color_scheme="rotate_16").sparktext)
+
+
+def test_stats():
+
+    assert get_stats() == {}
+    events = []
+    enable_stats(lambda *args: events.append(args))
+    try:
+        widget = SparkColumnWidget(list(range(10)), color_scheme="rotate_16")
+        widget.render((20,))
+        counters = get_stats()["SparkColumnWidget"]
+        assert counters["construct"] == 1
+        assert counters["render"] == 1
+        assert counters["quantized"] == 10
+        assert counters["markup_glyphs"] == 10
+        assert events
+        reset_stats()
+        assert get_stats() == {}
+    finally:
+        disable_stats()
+    assert get_stats() == {}
+
+
+def test_sample_feeder():
+
+    import threading
+
+    widget = SparkColumnWidget([])
+    group = SparkGroup([[], []])
+    feeder = SampleFeeder()
+
+    def worker(k):
+        for i in range(1000):
+            feeder.push(widget, i)
+            feeder.push(group, i, index=k % 2)
+
+    threads = [ threading.Thread(target=worker, args=(k,)) for k in range(4) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    feeder.flush()
+
+    assert sorted(widget.values) == sorted(list(range(1000)) * 4)
+    assert [ len(row.values) for row in group.sparks ] == [2000, 2000]
+    assert feeder.pending == 0
+
+    feeder = SampleFeeder(max_pending=10)
+    feeder.push_many(widget, range(25))
+    assert feeder.dropped == 15
+    feeder.flush()
+    assert list(widget.values)[-10:] == list(range(15, 25))
+
+
+class StubLoop(object):
+    # records the alarms an UpdateScheduler sets on a MainLoop
+
+    def __init__(self):
+        self.alarms = []
+
+    def set_alarm_in(self, delay, callback):
+        self.alarms.append((delay, callback))
+        return len(self.alarms)
+
+    def remove_alarm(self, handle):
+        return False
+
+    def fire(self):
+        (delay, callback) = self.alarms[-1]
+        callback(self, None)
+
+
+def test_update_scheduler(monkeypatch):
+
+    import time
+
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    loop = StubLoop()
+    scheduler = UpdateScheduler(loop, max_fps=10)
+    widget = SparkColumnWidget([])
+    group = SparkGroup([[], []])
+
+    # a burst of updates is applied on a single frame
+    for i in range(5):
+        scheduler.append(widget, i)
+        scheduler.append(group, i, index=i % 2)
+    scheduler.extend(widget, [5, 6])
+    assert [ delay for (delay, callback) in loop.alarms ] == [0]
+    assert scheduler.pending and not widget.values
+    loop.fire()
+    assert list(widget.values) == list(range(7))
+    assert [ list(row.values) for row in group.sparks ] == [[0, 2, 4], [1, 3]]
+    assert scheduler.frames == 1 and not scheduler.pending
+
+    # the next frame waits out the rest of 1 / max_fps
+    now[0] += 0.025
+    calls = []
+    scheduler.call(lambda: calls.append("first"), key="bar")
+    scheduler.call(lambda: calls.append("second"), key="bar")
+    scheduler.call(lambda: calls.append("unkeyed"))
+    assert len(loop.alarms) == 2
+    assert abs(loop.alarms[-1][0] - 0.075) < 1e-9
+    loop.fire()
+    assert calls == ["second", "unkeyed"]
+
+    bar = SparkBarWidget([1, 2, 3], 12, color_scheme="rotate_16")
+    try:
+        scheduler.append(bar, 4)
+    except Exception as e:
+        assert "SparkBarWidget" in str(e)
+    else:
+        assert False, "bar widgets can't be added to"
+    assert not scheduler.pending
+    scheduler.call(lambda: bar.update([3, 2, 1]), key=bar)
+    loop.fire()
+    assert bar.sparktext == SparkBarWidget([3, 2, 1], 12,
+                                           color_scheme="rotate_16").sparktext
+
+
+def test_update_scheduler_asyncio():
+
+    import asyncio
+
+    aloop = asyncio.new_event_loop()
+    try:
+        scheduler = UpdateScheduler(urwid.AsyncioEventLoop(loop=aloop), max_fps=5)
+        widget = SparkColumnWidget([])
+        scheduler.extend(widget, [1, 2, 3])
+        scheduler.append(widget, 4)
+        aloop.run_until_complete(asyncio.sleep(0.01))
+        assert list(widget.values) == [1, 2, 3, 4]
+        assert scheduler.frames == 1
+
+        scheduler.append(widget, 5)
+        aloop.run_until_complete(asyncio.sleep(0.005))
+        assert scheduler.pending
+        aloop.run_until_complete(asyncio.sleep(0.3))
+        assert list(widget.values) == [1, 2, 3, 4, 5]
+        assert scheduler.frames == 2
+    finally:
+        aloop.close()
+
+
+def test_render_text():
+
+    items = [ random.Random(5).uniform(0, 100) for i in range(40) ]
+    widget = SparkColumnWidget(items, color_scheme="rotate_16", height=2)
+    text = render_text(items, color_scheme="rotate_16", height=2)
+    assert [ row.decode("utf-8") for row in widget.render((40,)).text ] == text.split("\n")
+
+    colored = render_text(items, color_scheme="rotate_16", colors=16)
+    assert colored.startswith("\x1b[0;31;49m") and colored.endswith(ANSI_RESET)
+    assert colored.replace(ANSI_RESET, "").count("\x1b[") == 40
+    assert ansi_escape("#ff0000:h17", 2**24) == "\x1b[0;38;2;255;0;0;48;2;0;0;95m"
+    assert ansi_escape("no such color", 256) is None
+
+    # colors the terminal can't show fall back to the nearest it can
+    assert (render_text([ ("#ff8800", 3), ("#00ff00", 5) ], colors=16)
+            == "\x1b[0;33;49m\u2581%s\x1b[0;92;49m\u2588%s" %(ANSI_RESET, ANSI_RESET))
+    assert ansi_escape("h200:#000000", 88) == "\x1b[0;95;40m"
+    assert ansi_escape("my attr", 16) is None
+    for scheme in [ "rotate_256", "rotate_true" ]:
+        for kind in [ "bar", "column" ]:
+            text = render_text([ 5, 44, 22, 43, 30 ], kind=kind, width=20,
+                               color_scheme=scheme, colors=16)
+            runs = text.split(ANSI_RESET)[:-1]
+            assert len(runs) >= 5
+            assert all(run.startswith("\x1b[0;") for run in runs)
+
+    series = [ items[i:] for i in range(10) ]
+    assert (render_many(series, processes=2, chunksize=3)
+            == [ render_text(s) for s in series ])
+
+
+def test_dot_widget(monkeypatch):
+
+    import urwid_sparkwidgets
+
+    assert SparkDotWidget(list(range(8))).text == "\u28c0\u28e4\u28f6\u28ff"
+    assert (SparkDotWidget(list(range(8)), style="halfblock", height=2).text
+            == "  \u2584\u2588\n\u2584\u2588\u2588\u2588")
+
+    rnd = random.Random(6)
+    items = [ rnd.uniform(-10, 100) for i in range(101) ]
+    widget = SparkDotWidget(items, color_scheme="signed", height=2)
+    levels = [ widget.value_to_glyph(v, *widget.get_bounds()) for v in items ]
+    colors = [ widget.get_color(v) for v in items ]
+    vectorized = widget.make_markup(colors, levels)
+    monkeypatch.setattr(urwid_sparkwidgets, "VECTORIZE_THRESHOLD", len(items) * 2)
+    assert widget.make_markup(colors, levels) == vectorized
+    assert widget.sparktext == vectorized
+
+    widget = SparkDotWidget(items, reducer="mean")
+    assert widget.render((20,)).cols() == 20
+    assert widget.rows((60,)) == 1
+
+
+def test_buffer_windows(tmp_path):
+
+    import array
+    import mmap
+
+    rnd = random.Random(7)
+    data = [ rnd.uniform(-5, 50) for i in range(1000) ]
+    path = tmp_path / "samples"
+    path.write_bytes(array.array("d", data).tobytes())
+
+    with open(path, "r+b") as f:
+        samples = mmap.mmap(f.fileno(), 0)
+        for compact in [False, True]:
+            expected = SparkColumnWidget(data[100:300], color_scheme="rotate_16",
+                                         compact=compact)
+            widget = SparkColumnWidget(samples, color_scheme="rotate_16",
+                                       compact=compact, offset=100, length=200)
+            assert widget.text == expected.text
+            widget.update(memoryview(array.array("d", data)), 100, 200)
+            assert widget.text == expected.text
+
+        bar = SparkBarWidget(samples, 20, color_scheme="rotate_16",
+                             offset=5, length=4)
+        assert bar.sparktext == SparkBarWidget(
+            data[5:9], 20, color_scheme="rotate_16").sparktext
+        # nothing holds on to the buffer
+        del widget, bar
+        samples.close()
+
+    # typed buffers are read as the numbers of their format
+    for typecode in "bBhHiIlLqQfd":
+        values = list(range(1, 11))
+        expected = SparkColumnWidget(values, color_scheme="rotate_16").text
+        buffer = array.array(typecode, values)
+        assert list(SparkWidget.window(buffer, 2, 5)) == values[2:7]
+        for compact in [False, True]:
+            widget = SparkColumnWidget(buffer, color_scheme="rotate_16",
+                                       compact=compact)
+            assert widget.text == expected
+    signed = array.array("b", range(-8, 8))
+    assert (SparkColumnWidget(signed, color_scheme="signed").text
+            == SparkColumnWidget(list(range(-8, 8)), color_scheme="signed").text)
+    assert (SparkColumnWidget(bytes([1, 2, 3, 4, 5])).text
+            == SparkColumnWidget([1, 2, 3, 4, 5]).text)
+    assert (SparkBarWidget(array.array("B", [1, 2, 3]), 12,
+                           color_scheme="rotate_16").sparktext
+            == SparkBarWidget([1, 2, 3], 12, color_scheme="rotate_16").sparktext)
+
+
+def test_color_quantizer():
+
+    quantizer = ColorQuantizer(["black", "dark red", "#00ff00"])
+    assert quantizer.nearest("#e00010") == "dark red"
+    assert quantizer.quantize("#10f020:#000001") == "#00ff00:black"
+    assert quantizer.quantize("default:no such color") == "default:no such color"
+
+    rnd = random.Random(8)
+    items = [ ("#%06x" %(rnd.randrange(1 << 24)), rnd.randint(1, 50), "x")
+              for i in range(200) ]
+    SparkWidget.color_quantizer = ColorQuantizer(16)
+    try:
+        attrs = set()
+        for i in range(0, 200, 5):
+            bar = SparkBarWidget(items[i:i+5], 30)
+            attrs.update(attr for (attr, text) in bar.sparktext)
+            column = SparkColumnWidget([ (c, v) for (c, v, l) in items[i:i+5] ])
+            attrs.update(attr for (attr, text) in column.sparktext)
+    finally:
+        SparkWidget.color_quantizer = None
+    basic = set(urwid.display_common._BASIC_COLORS)
+    assert all(set(attr.split(":")) <= basic for attr in attrs)
+
+
+def test_scrolling_matches_rebuild():
+
+    rnd = random.Random(9)
+    for scheme in ["mono", "rotate_16", "signed"]:
+        options = dict(color_scheme=scheme, underline="negative", align="right")
+        items = [ rnd.uniform(0, 100) for i in range(30) ]
+        widget = SparkColumnWidget(items, max_length=30, **options)
+        for i in range(200):
+            items.append(rnd.choice([ rnd.uniform(-10, 110), ("light red", 50) ]))
+            widget.append(items[-1])
+            # a rotating scheme colors the window as the widget saw it
+            window = [
+                item if isinstance(item, tuple) or scheme != "rotate_16"
+                else (DISTINCT_COLORS_16[
+                    sum(not isinstance(x, tuple) for x in items[:k])
+                    % len(DISTINCT_COLORS_16)], item)
+                for (k, item) in enumerate(items) if k >= len(items) - 30
+            ]
+            expected = SparkColumnWidget(window, **options)
+            size = (rnd.choice([20, 40]),)
+            assert widget.sparktext == expected.sparktext
+            assert (list(widget.render(size).content())
+                    == list(expected.render(size).content()))
+            assert widget.rows(size) == expected.rows(size)
+        assert widget.text == urwid.Text(widget.sparktext).text
+
+
+def test_histogram():
+
+    rnd = random.Random(10)
+    samples = [ rnd.uniform(-10, 110) for i in range(2000) ] + [ float("nan") ]
+    widget = SparkHistogramWidget(samples[:1000], 0, 100, bins=20)
+    for sample in samples[1000:]:
+        widget.append(sample)
+
+    expected = [0] * 20
+    for sample in samples[:-1]:
+        expected[min(max(int(sample // 5), 0), 19)] += 1
+    assert widget.counts == expected
+    assert widget.text == SparkColumnWidget(expected, scale_min=0).text
+
+    log = SparkHistogramWidget([1, 9, 10, 99, 100, 1000], 1, 1000, bins=3,
+                               bin_scale="log")
+    assert log.counts == [2, 2, 2]
+
+    decaying = SparkHistogramWidget([50] * 10, 0, 100, bins=2, half_life=10)
+    decaying.extend([10] * 10)
+    assert decaying.counts[0] > decaying.counts[1]
+    assert abs(decaying.counts[1] * 2 - sum(0.5 ** (i / 10) for i in range(10))) < 1e-9
+
+    windowed = SparkHistogramWidget([], 0, 100, bins=4, window_length=100, panes=4)
+    windowed.extend([10] * 1000)
+    windowed.extend([90] * 60)
+    assert 75 <= windowed.total <= 100
+    assert windowed.counts[3] == 60
+
+
+def test_render_cache():
+
+    cache = RenderCache(maxsize=3)
+    for key in "abc":
+        cache.put(key, key * 10)
+    assert cache.get("a") == "a" * 10
+    cache.put("d", "d" * 10)
+    # "b" is the least recently used entry
+    assert cache.get("b") is None
+    assert [ cache.get(key) for key in "acd" ] == [ "a" * 10, "c" * 10, "d" * 10 ]
+    assert cache.stats["hits"] == 4
+    assert cache.stats["misses"] == 1
+
+    cache.resize(2)
+    assert len(cache) == 2
+    assert cache.get("a") is None
+    assert cache.get("c") == "c" * 10
+
+    cache.resize(maxbytes=cache.nbytes - 1)
+    assert len(cache) == 1
+    assert cache.get("c") == "c" * 10
+    cache.put("e", "e" * cache.maxbytes)
+    assert cache.get("e") is None
+    assert len(cache) == 1
+
+    cache.resize(0)
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+    cache.put("f", "f")
+    assert cache.get("f") is None
+
+    cache.clear()
+    assert cache.stats["hits"] == cache.stats["misses"] == 0
+
+
+def test_render_cache_widgets(monkeypatch):
+
+    cache = RenderCache()
+    monkeypatch.setattr(SparkWidget, "render_cache", cache)
+    rng = random.Random(7)
+    values = [ rng.random() for i in range(100) ]
+
+    first = SparkColumnWidget(values, color_scheme="rotate_16")
+    first.render((100,))
+    entries = len(cache)
+    assert entries
+    second = SparkColumnWidget(values, color_scheme="rotate_16")
+    assert second.render((100,)).text == first.render((100,)).text
+    assert len(cache) == entries
+    hits = cache.hits
+    assert hits
+
+    # streaming widgets neither look up nor store markup and canvases
+    live = SparkColumnWidget([], color_scheme="rotate_16", max_length=100)
+    for value in values * 3:
+        live.append(value)
+        live.render((100,))
+    live.update(values)
+    live.render((100,))
+    assert len(cache) == entries
+    bar = SparkBarWidget([ 1, 2, 3 ], 30, color_scheme="rotate_16")
+    bar.render((30,))
+    entries = len(cache)
+    for i in range(50):
+        bar.set_value(0, i + 1)
+        bar.render((30,))
+    assert len(cache) == entries
+    assert cache.hits == hits
+
+
+def test_public_names():
+
+    import urwid_sparkwidgets
+
+    for name in urwid_sparkwidgets.__all__:
+        assert hasattr(urwid_sparkwidgets, name), name
+    for name in [ "np", "stats", "array", "time", "os", "sys", "urwid" ]:
+        assert name not in urwid_sparkwidgets.__all__
+    assert set(urwid_sparkwidgets.PALETTE_NAMES) <= set(urwid_sparkwidgets.__all__)
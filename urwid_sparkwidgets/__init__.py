@@ -15,15 +15,91 @@ hopefully useful sparkline-like visualizations of data.
 
 
 import urwid
-from urwid_utils.palette import *
 from collections import deque
+import importlib
 import math
 import operator
 import collections
+import collections.abc
+import functools
+import string
+import time
+import hashlib
+import mmap
+import concurrent.futures
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import groupby, islice, repeat
+
+# NumPy is only imported when a vectorized path is first taken: np is None
+# until load_numpy() has been called, and stays None if it isn't installed.
+np = None
+_numpy_loaded = False
+
+# names re-exported from urwid_utils.palette, which is likewise imported on
+# first use (see __getattr__)
+PALETTE_NAMES = (
+    "BASIC_COLORS", "COLORS_ALLOWED_MAP", "Palette", "PaletteEntry", "STYLES",
+    "URWID_HAS_TRUE_COLOR", "is_valid_identifier"
+)
+
+
+def load_numpy():
+    """
+    Import NumPy if it is installed and return it, otherwise return None.
+    """
+
+    global np, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            np = importlib.import_module("numpy")
+        except ImportError:
+            np = None
+    return np
+
+
+def is_ndarray(values):
+    # only true if someone has imported NumPy, so this never imports it
+    return ("numpy" in sys.modules
+            and load_numpy() is not None
+            and isinstance(values, np.ndarray))
+
+
+def __getattr__(name):
+
+    if name in PALETTE_NAMES:
+        return getattr(importlib.import_module("urwid_utils.palette"), name)
+    raise AttributeError("module %r has no attribute %r" %(__name__, name))
 
 BLOCK_VERTICAL = [ chr(x) for x in range(0x2581, 0x2589) ]
 BLOCK_HORIZONTAL = [ chr(x) for x in range(0x258F, 0x2587, -1) ]
 
+# two-sample cells by (left, right) fill: DOT_STYLES[style][left][right], each
+# column of a cell filling from the bottom up
+BRAILLE_CELLS = [
+    "".join([ chr(0x2800 + left + right) if left + right else " "
+              for right in (0, 0x80, 0xA0, 0xB0, 0xB8) ])
+    for left in (0, 0x40, 0x44, 0x46, 0x47)
+]
+QUADRANT_CELLS = [
+    " \N{QUADRANT LOWER RIGHT}\N{RIGHT HALF BLOCK}",
+    "\N{QUADRANT LOWER LEFT}\N{LOWER HALF BLOCK}"
+    "\N{QUADRANT UPPER RIGHT AND LOWER LEFT AND LOWER RIGHT}",
+    "\N{LEFT HALF BLOCK}\N{QUADRANT UPPER LEFT AND LOWER LEFT AND LOWER RIGHT}"
+    "\N{FULL BLOCK}"
+]
+DOT_STYLES = {
+    "braille": BRAILLE_CELLS,
+    "halfblock": QUADRANT_CELLS
+}
+
+# minimum number of values before quantization is handed off to NumPy
+VECTORIZE_THRESHOLD = 64
+
 DEFAULT_LABEL_COLOR = "light gray"
 DEFAULT_LABEL_COLOR_DARK = "black"
 DEFAULT_LABEL_COLOR_LIGHT = "white"
@@ -76,16 +152,67 @@ COLOR_SCHEMES = {
     }
 }
 
+# urwid's monochrome setting for chart attributes: plain text
+NORMAL_MONO = "default"
+NORMAL_FG_16 = "light gray"
+NORMAL_BG_16 = "black"
+NORMAL_FG_256 = "light gray"
+NORMAL_BG_256 = "black"
+
+
+def _palette_entry(**fields):
+    # urwid_utils checks every field against its colors and styles, but urwid
+    # only takes "default" and styles for mono, so that is set afterwards
+
+    from urwid_utils.palette import PaletteEntry
+
+    entry = PaletteEntry(**fields)
+    entry[PaletteEntry.attrs.index("mono")] = NORMAL_MONO
+    return entry
+
+
+def _make_palette_entry(name, fcolor, bcolor=None):
+
+    if bcolor is None:
+        return _palette_entry(
+            name = name,
+            foreground = (fcolor
+                          if fcolor in urwid.display_common._BASIC_COLORS
+                          else NORMAL_FG_16),
+            background = NORMAL_BG_16,
+            foreground_high = fcolor,
+            background_high = NORMAL_BG_256
+        )
+
+    return _palette_entry(
+        name = name,
+        foreground = (fcolor
+                      if fcolor in urwid.display_common._BASIC_COLORS
+                      else NORMAL_BG_16),
+        background = (bcolor
+                      if bcolor in urwid.display_common._BASIC_COLORS
+                      else NORMAL_BG_16),
+        foreground_high = fcolor,
+        background_high = bcolor
+    )
+
+
+def get_palette_entry(name):
+    """
+    Build the PaletteEntry for one attribute name of the form "fg" or
+    "fg:bg", as found in the markup of the spark widgets.  Raises ValueError
+    if the name does not describe valid colors.
+    """
+
+    return _make_palette_entry(name, *name.split(":", 1))
+
+
 def get_palette_entries(
         chart_colors = None,
         label_colors = None
 ):
 
-    NORMAL_FG_MONO = "white"
-    NORMAL_FG_16 = "light gray"
-    NORMAL_BG_16 = "black"
-    NORMAL_FG_256 = "light gray"
-    NORMAL_BG_256 = "black"
+    from urwid_utils.palette import PaletteEntry
 
     palette_entries = {}
 
@@ -114,25 +241,22 @@ def get_palette_entries(
             fbg = NORMAL_BG_16
             ffghi = fcolor.foreground_high
             fbghi = NORMAL_BG_256
+            palette_entries.update({
+                fname: _palette_entry(
+                    name = fname,
+                    foreground = ffg,
+                    background = fbg,
+                    foreground_high = ffghi,
+                    background_high = fbghi
+                ),
+            })
         else:
             fname = fcolor
             ffg = (fcolor
                   if fcolor in urwid.display_common._BASIC_COLORS
                   else NORMAL_FG_16)
-            fbg = NORMAL_BG_16
             ffghi = fcolor
-            fbghi = NORMAL_BG_256
-
-        palette_entries.update({
-            fname: PaletteEntry(
-                name = fname,
-                mono = NORMAL_FG_MONO,
-                foreground = ffg,
-                background = fbg,
-                foreground_high = ffghi,
-                background_high = fbghi
-            ),
-        })
+            palette_entries[fname] = _make_palette_entry(fname, fcolor)
 
         for bcolor in bcolors:
 
@@ -150,9 +274,8 @@ def get_palette_entries(
                 bbghi = bcolor
 
             palette_entries.update({
-                bname: PaletteEntry(
+                bname: _palette_entry(
                     name = bname,
-                    mono = NORMAL_FG_MONO,
                     foreground = (bfg
                                   if bfg in urwid.display_common._BASIC_COLORS
                                   else NORMAL_BG_16),
@@ -167,19 +290,139 @@ def get_palette_entries(
     return palette_entries
 
 
-def get_label_color(color,
-                    dark=DEFAULT_LABEL_COLOR_DARK,
-                    light=DEFAULT_LABEL_COLOR_LIGHT):
+class PaletteRegistry(object):
+    """
+    Registers palette entries on demand for the attributes the spark widgets
+    actually use.
+
+    Rather than building an entry for every foreground / background pair up
+    front with get_palette_entries(), assign a registry to
+    SparkWidget.palette_registry and each "fg" or "fg:bg" attribute will be
+    registered with the screen the first time any widget emits it.
+
+    :param screen: The urwid screen to register entries with.  Can also be
+    given later with attach(), at which point entries collected so far are
+    registered.
+    """
+
+    def __init__(self, screen = None):
+
+        self.screen = None
+        self.entries = collections.OrderedDict()
+        # attributes that aren't color names, e.g. user-defined ones
+        self.ignored = set()
+        if screen is not None:
+            self.attach(screen)
+
+    @property
+    def attributes(self):
+        """
+        The set of attribute names registered so far.
+        """
+        return frozenset(self.entries)
+
+    def attach(self, screen):
+
+        self.screen = screen
+        for entry in self.entries.values():
+            screen.register_palette_entry(*entry)
+
+    def register(self, attr):
+
+        if attr in self.entries or attr in self.ignored:
+            return
+
+        try:
+            entry = get_palette_entry(attr)
+        except (ValueError, AttributeError):
+            self.ignored.add(attr)
+            return
+
+        self.entries[attr] = entry
+        if self.screen is not None:
+            self.screen.register_palette_entry(*entry)
+        if stats is not None:
+            stats.add(type(self).__name__, "attributes")
+
+    def register_markup(self, markup):
+
+        for item in markup:
+            if isinstance(item, tuple):
+                self.register(item[0])
+
+
+def _luminance(r, g, b):
     # http://jsfiddle.net/cu4z27m7/66/
-    (r, g, b) = urwid.AttrSpec(color, color).get_rgb_values()[:3]
     colors = [r / 255, g / 255, b / 255]
     c = [ (c / 12.92)
           if c < 0.03928
           else ((c + 0.055) / 1.055)**2.4
           for c in colors ]
 
-    L = 0.2126 * c[0] + 0.7152 * c[1] + 0.0722 * c[2]
-    return dark if L > 0.179 else light
+    return 0.2126 * c[0] + 0.7152 * c[1] + 0.0722 * c[2]
+
+
+# luminance of the 256 palette colors by number, and of the basic color names
+# and "h0".."h255", built on first use
+_luminance_256 = None
+_luminance_names = None
+
+
+def _build_luminance_tables():
+
+    global _luminance_256, _luminance_names
+
+    _luminance_256 = [
+        _luminance(*rgb) for rgb in urwid.display_common._COLOR_VALUES_256
+    ]
+    _luminance_names = dict(
+        [ (name, _luminance_256[i])
+          for i, name in enumerate(urwid.display_common._BASIC_COLORS) ]
+        + [ ("h%d" %(i), l) for i, l in enumerate(_luminance_256) ]
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _attrspec_luminance(color):
+    return _luminance(*urwid.AttrSpec(color, color).get_rgb_values()[:3])
+
+
+def color_luminance(color):
+    """
+    Return the relative luminance of an urwid color description, as the
+    color urwid.AttrSpec would choose for it in 256-color mode.
+    """
+
+    if _luminance_names is None:
+        _build_luminance_tables()
+
+    try:
+        return _luminance_names[color]
+    except (KeyError, TypeError):
+        pass
+
+    if (isinstance(color, str) and color.startswith("#")
+        and len(color) in (4, 7)
+        and all(c in string.hexdigits for c in color[1:])):
+        # in 256-color mode AttrSpec reduces #rrggbb to #rgb by dropping the
+        # low digits and then snaps #rgb to the nearest color cube entry
+        short = color if len(color) == 4 else "#" + color[1:7:2]
+        try:
+            return _luminance_names[short]
+        except KeyError:
+            l = _luminance_256[urwid.display_common._parse_color_256(short)]
+            _luminance_names[short] = l
+            return l
+
+    return _attrspec_luminance(color)
+
+
+def get_label_color(color,
+                    dark=DEFAULT_LABEL_COLOR_DARK,
+                    light=DEFAULT_LABEL_COLOR_LIGHT):
+
+    return dark if color_luminance(color) > 0.179 else light
+
 
 
 
@@ -192,23 +435,878 @@ OPERATOR_MAP = {
     "else": lambda a, b: True
 }
 
+# default maximum number of times per second UpdateScheduler applies updates
+DEFAULT_MAX_FPS = 10
+
+# default number of samples a SampleFeeder holds before dropping the oldest
+FEEDER_MAX_PENDING = 100000
+
+# number of series render_many() sends to a worker process at a time
+RENDER_CHUNK_SIZE = 256
+
+# default number of bins and of window panes of a SparkHistogramWidget
+HISTOGRAM_BINS = 32
+HISTOGRAM_PANES = 4
+
+# sample weight at which a decaying histogram rescales its counts
+HISTOGRAM_MAX_WEIGHT = 1e100
+
+ANSI_RESET = "\x1b[0m"
+
+# default number of markup / canvas entries kept by render_cache
+RENDER_CACHE_SIZE = 1024
+
+# default approximate number of bytes of markup / canvases kept by render_cache
+RENDER_CACHE_BYTES = 16 * 1024 * 1024
+
+# number of distinct attributes a compact SparkColumnWidget collects before
+# dropping the ones it no longer charts
+COMPACT_ATTR_LIMIT = 1024
+
+# linear range around zero of the "symlog" scale
+SYMLOG_LINTHRESH = 1
+
+# maximum number of compiled "rules" color schemes kept by compile_rules()
+RULES_CACHE_SIZE = 128
+
+# number of attributes a ColorQuantizer remembers the snapped form of
+PALETTE_CACHE_SIZE = 4096
+
+_rules_cache = collections.OrderedDict()
+
+
+class RuleTable(object):
+    """
+    A "rules" color scheme compiled into a table of thresholds.
+
+    The thresholds named by the rules split the number line into open
+    intervals and the threshold points themselves.  No rule can tell two
+    values in the same region apart, so the matching color is worked out once
+    per region and a value is classified with a single bisect, or a whole
+    NumPy array at once with classify().
+    """
+
+    def __init__(self, scheme):
+
+        # only needed here, and slow to import with the package
+        from fractions import Fraction
+
+        rules = scheme["rules"]
+        colors = scheme["colors"]
+
+        def match(value):
+            for rule in rules:
+                if OPERATOR_MAP[rule[0]](value, rule[1] if len(rule) > 1 else None):
+                    return colors.get(rule[-1])
+            return None
+
+        self.edges = sorted(set(
+            rule[1] for rule in rules if rule[0] != "else"
+        ))
+
+        def midpoint(a, b):
+            # exactly halfway, so that ints between two large float edges
+            # are not rounded onto one of them
+            if a in (-math.inf, math.inf) or b in (-math.inf, math.inf):
+                return a / 2 + b / 2
+            return (Fraction(a) + Fraction(b)) / 2
+
+        # one sample inside each region around the edges
+        samples = [-math.inf] + [
+            midpoint(a, b) for a, b in zip(self.edges, self.edges[1:])
+        ]
+        if self.edges:
+            samples.append(math.inf)
+
+        self.points = [ match(edge) for edge in self.edges ]
+        self.intervals = [ match(sample) for sample in samples ]
+        # NaN fails every comparison, so only "else" can match it
+        self.nan = match(math.nan)
+
+    def __call__(self, value):
+
+        if value != value:
+            return self.nan
+        i = bisect_left(self.edges, value)
+        if i < len(self.edges) and self.edges[i] == value:
+            return self.points[i]
+        return self.intervals[i]
+
+    def classify(self, values):
+        """
+        Return a NumPy object array of colors for a NumPy array of values.
+        """
+
+        load_numpy()
+        intervals = np.array(self.intervals, dtype=object)
+        if not self.edges:
+            return intervals[np.zeros(len(values), dtype=np.intp)]
+
+        edges = np.array(self.edges)
+        idx = np.searchsorted(edges, values, side="left")
+        on_edge = edges[np.minimum(idx, len(edges) - 1)] == values
+        colors = intervals[idx]
+        colors[on_edge] = np.array(self.points, dtype=object)[idx[on_edge]]
+        colors[np.isnan(values)] = self.nan
+        return colors
+
+
+class QuantizationTable(object):
+    """
+    The glyph thresholds of a chart scale.
+
+    edges[k] is the smallest value drawn with glyph k (edges[0] is -inf), so a
+    value's glyph is found with a single bisect, or the glyphs of a whole
+    NumPy array with a single searchsorted.
+
+    :param scale: "linear", "log" or "symlog".  Linear tables reproduce
+    int(round(normalize(...))) exactly.  Log scales need positive bounds and
+    fall back to symlog otherwise; symlog is linear within SYMLOG_LINTHRESH of
+    zero and logarithmic beyond it, so it handles zero and negative values.
+
+    :param scale_min: Value at the bottom of the chart.
+
+    :param scale_max: Value at the top of the chart.
+
+    :param n: Number of glyphs.
+    """
+
+    def __init__(self, scale, scale_min, scale_max, n):
+
+        self.scale = scale
+        self.scale_min = scale_min
+        self.scale_max = scale_max
+        self.n = n
+        self.sign = 1
+
+        if scale not in ("linear", "log", "symlog"):
+            raise Exception("Unknown scale: %s" %(scale))
+
+        if scale == "log" and not scale_min > 0:
+            scale = "symlog"
+
+        if scale_max == scale_min or (scale != "linear" and scale_max < scale_min):
+            # everything is drawn with the lowest glyph
+            self.edges = [-math.inf]
+        elif scale == "linear":
+            if scale_max < scale_min:
+                # a flipped scale is the normal one applied to negated values
+                self.sign = -1
+                scale_min, scale_max = -scale_min, -scale_max
+            self.edges = [-math.inf] + [
+                self._linear_edge(k, scale_min, scale_max)
+                for k in range(1, n)
+            ]
+        else:
+            if scale == "log":
+                forward, inverse = math.log, math.exp
+            else:
+                forward = lambda v: math.copysign(
+                    math.log10(1 + abs(v) / SYMLOG_LINTHRESH), v)
+                inverse = lambda y: math.copysign(
+                    SYMLOG_LINTHRESH * (10 ** abs(y) - 1), y)
+            lo = forward(scale_min)
+            hi = forward(scale_max)
+            self.edges = [-math.inf] + [
+                inverse(lo + (k - 0.5) / (n - 1) * (hi - lo))
+                for k in range(1, n)
+            ]
+
+        self._edges_array = None
+
+    def _linear_edge(self, k, scale_min, scale_max):
+
+        def glyph(v):
+            return int(round(SparkWidget.normalize(v, 0, self.n - 1,
+                                                    scale_min, scale_max)))
+
+        # start from the exact edge and step by one float at a time to the
+        # first value the scalar formula rounds up to k
+        edge = scale_min + (k - 0.5) / (self.n - 1) * (scale_max - scale_min)
+        for i in range(64):
+            if glyph(edge) < k:
+                break
+            edge = math.nextafter(edge, -math.inf)
+        for i in range(128):
+            if glyph(edge) >= k:
+                break
+            edge = math.nextafter(edge, math.inf)
+        return edge
+
+    def index(self, value):
+        """
+        Return the glyph index of one value.
+        """
+        return bisect_right(self.edges, self.sign * value) - 1
+
+    def indexes(self, values):
+        """
+        Return the glyph indexes of a NumPy array of values.
+        """
+        if self._edges_array is None:
+            self._edges_array = load_numpy().array(self.edges)
+        return np.searchsorted(
+            self._edges_array, values if self.sign > 0 else -values,
+            side="right"
+        ) - 1
+
+
+@functools.lru_cache(maxsize=256)
+def get_quantization_table(scale, scale_min, scale_max, n):
+    """
+    Return the (cached) QuantizationTable for a scale.
+    """
+    return QuantizationTable(scale, scale_min, scale_max, n)
+
+
+def compile_rules(scheme):
+    """
+    Return the RuleTable for a "rules" color scheme, compiling it on first use.
+    Compiled tables are cached by scheme identity.
+    """
+
+    try:
+        cached_scheme, table = _rules_cache[id(scheme)]
+        if cached_scheme is scheme:
+            _rules_cache.move_to_end(id(scheme))
+            return table
+    except KeyError:
+        pass
+
+    table = RuleTable(scheme)
+    _rules_cache[id(scheme)] = (scheme, table)
+    while len(_rules_cache) > RULES_CACHE_SIZE:
+        _rules_cache.popitem(last=False)
+    return table
+
+
+def digest(*parts):
+    """
+    Return a short, collision-resistant digest of one or more byte strings,
+    for use in cache keys.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part)
+    return h.digest()
+
+
+def approx_size(value):
+    """
+    Return the approximate number of bytes taken by value, a cache key or
+    value made of strings, numbers, tuples / lists and canvases.  Objects
+    shared between entries are counted for each of them.
+    """
+
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(approx_size(v) for v in value)
+    if isinstance(value, urwid.Canvas):
+        return sys.getsizeof(value) + sum(
+            approx_size(getattr(value, name, None))
+            for name in ("_text", "_attr", "_cs")
+        )
+    return sys.getsizeof(value)
+
+
+class RenderCache(object):
+    """
+    A size-bounded LRU cache of widget markup and canvases.
+
+    A single instance, render_cache, is shared by all spark widgets so that
+    widgets built from identical data reuse each other's markup and rendered
+    canvases.  Markup is keyed on a digest of the values and colors together
+    with the scale bounds and markers (or width and scheme for bar widgets);
+    canvases are keyed on the markup and the render size.
+
+    Entries are evicted least recently used first once there are more than
+    maxsize of them or their approximate size (see approx_size()) exceeds
+    maxbytes.  Widgets whose data is streaming in skip the cache, see
+    SparkWidget.caching().
+
+    :param maxsize: Maximum number of entries.  0 disables caching.
+
+    :param maxbytes: Approximate maximum number of bytes of keys and values.
+    """
+
+    def __init__(self, maxsize = RENDER_CACHE_SIZE, maxbytes = RENDER_CACHE_BYTES):
+
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+
+        try:
+            value = self.entries[key][0]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+
+        if not self.maxsize:
+            return
+        nbytes = approx_size(key) + approx_size(value)
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        self._evict()
+
+    def resize(self, maxsize = None, maxbytes = None):
+        """
+        Change the maximum number of entries and / or bytes, evicting entries
+        beyond the new bounds.
+        """
+
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if maxbytes is not None:
+            self.maxbytes = maxbytes
+        self._evict()
+
+    def _evict(self):
+
+        while self.entries and (
+                len(self.entries) > self.maxsize
+                or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+        ):
+            self.nbytes -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "bytes": self.nbytes,
+            "maxbytes": self.maxbytes
+        }
+
+
+render_cache = RenderCache()
+
+
+@functools.lru_cache(maxsize=1024)
+def color_rgb(color):
+    """
+    Return the (r, g, b) values of an urwid color description, or None if it
+    is "default" or not a color.
+    """
+
+    if (len(color) == 7 and color.startswith("#")
+        and all(c in string.hexdigits for c in color[1:])):
+        return tuple([ int(color[i:i + 2], 16) for i in (1, 3, 5) ])
+
+    try:
+        rgb = urwid.AttrSpec(color, "default", 2**24).get_rgb_values()[:3]
+    except urwid.AttrSpecError:
+        return None
+    return None if rgb[0] is None else rgb
+
+
+class ColorQuantizer(object):
+    """
+    Snaps arbitrary colors to the nearest of a fixed set, so that charts
+    drawn with any number of distinct colors only ever emit a bounded number
+    of "fg" / "fg:bg" attributes.
+
+    Assign an instance to SparkWidget.color_quantizer to snap the colors of
+    bar chart segments and of explicitly colored column items; the palette
+    (or PaletteRegistry) then never needs more than the attributes made from
+    these colors.
+
+    :param colors: 16 for the basic colors, 256 for the basic colors and
+    "h16".."h255", or a list of urwid color descriptions.
+
+    :param maxsize: The number of colors to remember the nearest color of.
+    """
+
+    def __init__(self, colors = 16, maxsize = PALETTE_CACHE_SIZE):
+
+        if colors == 16:
+            colors = urwid.display_common._BASIC_COLORS
+        elif colors == 256:
+            colors = (urwid.display_common._BASIC_COLORS
+                      + [ "h%d" %(i) for i in range(16, 256) ])
+        self.colors = tuple([ c for c in colors if color_rgb(c) is not None ])
+        if not self.colors:
+            raise Exception("No valid colors to quantize to: %s" %(colors,))
+        self._rgb = [ color_rgb(c) for c in self.colors ]
+        self._rgb_array = None
+        self.cache = RenderCache(maxsize)
+
+    def nearest(self, color):
+        """
+        Return the color closest to color, or color itself if it is "default"
+        or not a color.
+        """
+
+        nearest = self.cache.get(color)
+        if nearest is not None:
+            return nearest
+
+        rgb = color_rgb(color)
+        if rgb is None:
+            nearest = color
+        elif len(self.colors) >= VECTORIZE_THRESHOLD and load_numpy() is not None:
+            if self._rgb_array is None:
+                self._rgb_array = np.array(self._rgb, dtype=float)
+            distances = ((self._rgb_array - rgb) ** 2).sum(axis=1)
+            nearest = self.colors[int(distances.argmin())]
+        else:
+            (r, g, b) = rgb
+            distances = [ (r - r2) ** 2 + (g - g2) ** 2 + (b - b2) ** 2
+                          for (r2, g2, b2) in self._rgb ]
+            nearest = self.colors[distances.index(min(distances))]
+
+        self.cache.put(color, nearest)
+        return nearest
+
+    def quantize(self, attr):
+        """
+        Return an "fg" or "fg:bg" attribute with its colors snapped.
+        """
+
+        if not attr:
+            return attr
+        return ":".join([ self.nearest(c) for c in attr.split(":") ])
+
+
+class Stats(object):
+    """
+    Per-class counters and timings recorded by the spark widgets while
+    instrumentation is turned on with enable_stats().
+
+    Counters are kept by class name ("SparkColumnWidget", "SparkBarWidget",
+    "SparkGroup", "PaletteRegistry") and include construct / render /
+    quantize calls with their total time in seconds (construct_time etc.),
+    quantized values, markups built with their total runs and glyphs, cache
+    hits and misses and palette attributes registered.
+
+    :param callback: If given, called as callback(class_name, counter,
+    amount) for every update, e.g. to feed a metrics pipeline.
+    """
+
+    def __init__(self, callback = None):
+
+        self.callback = callback
+        self.counters = collections.defaultdict(collections.Counter)
+
+    def add(self, owner, name, amount = 1):
+
+        self.counters[owner][name] += amount
+        if self.callback:
+            self.callback(owner, name, amount)
+
+    def add_time(self, owner, name, started):
+
+        self.add(owner, name)
+        self.add(owner, "%s_time" %(name), time.perf_counter() - started)
+
+
+# the active Stats, or None while instrumentation is off
+stats = None
+
+
+def enable_stats(callback = None):
+    """
+    Turn on instrumentation, discarding anything recorded so far.
+    """
+
+    global stats
+    stats = Stats(callback)
+    return stats
+
+
+def disable_stats():
+
+    global stats
+    stats = None
+
+
+def get_stats():
+    """
+    Return the recorded counters as a dictionary of dictionaries keyed by
+    class name, or an empty dictionary if instrumentation is off.
+    """
+
+    if stats is None:
+        return {}
+    return { owner: dict(counters) for owner, counters in stats.counters.items() }
+
+
+def reset_stats():
+
+    if stats is not None:
+        stats.counters.clear()
+
+
+def _bucket_edges(n, buckets):
+    return [ (i * n) // buckets for i in range(buckets + 1) ]
+
+
+def reduce_mean(values, width):
+    """
+    Downsample values to width buckets, each represented by its mean.
+
+    Like all reducers, takes a list or NumPy array of values and the number
+    of columns available, and returns a list of output values along with the
+    index of the input value each one stands for (used to pick its color).
+    """
+
+    edges = _bucket_edges(len(values), width)
+    if is_ndarray(values):
+        means = np.add.reduceat(values, edges[:-1]) / np.diff(edges)
+        return means.tolist(), [ b - 1 for b in edges[1:] ]
+
+    return (
+        [ sum(values[a:b]) / (b - a) for a, b in zip(edges, edges[1:]) ],
+        [ b - 1 for b in edges[1:] ]
+    )
+
+
+def reduce_max(values, width):
+    """
+    Downsample values to width buckets, each represented by its maximum.
+    """
+
+    edges = _bucket_edges(len(values), width)
+    if is_ndarray(values):
+        idx = [ a + int(np.argmax(values[a:b]))
+                for a, b in zip(edges, edges[1:]) ]
+        return values[idx].tolist(), idx
+
+    idx = [ max(range(a, b), key=values.__getitem__)
+            for a, b in zip(edges, edges[1:]) ]
+    return [ values[i] for i in idx ], idx
+
+
+def reduce_minmax(values, width):
+    """
+    Downsample values to width // 2 buckets, each represented by its minimum
+    and maximum in the order they occur, so that peaks and troughs survive.
+    """
+
+    edges = _bucket_edges(len(values), max(width // 2, 1))
+    if is_ndarray(values):
+        lo = [ a + int(np.argmin(values[a:b])) for a, b in zip(edges, edges[1:]) ]
+        hi = [ a + int(np.argmax(values[a:b])) for a, b in zip(edges, edges[1:]) ]
+    else:
+        lo = [ min(range(a, b), key=values.__getitem__)
+               for a, b in zip(edges, edges[1:]) ]
+        hi = [ max(range(a, b), key=values.__getitem__)
+               for a, b in zip(edges, edges[1:]) ]
+
+    idx = []
+    for l, h in zip(lo, hi):
+        idx.extend(sorted(set([l, h])) if width > 1 else [h])
+    idx = idx[:width]
+    return [ float(values[i]) for i in idx ], idx
+
+
+def reduce_lttb(values, width):
+    """
+    Downsample values to width points with the Largest-Triangle-Three-Buckets
+    algorithm, which keeps the visual shape of the series.
+    """
+
+    n = len(values)
+    if width < 3:
+        return reduce_mean(values, width)
+
+    # first and last points are always kept; the rest are split into buckets
+    edges = [ 1 + (i * (n - 2)) // (width - 2) for i in range(width - 1) ]
+    vectorized = is_ndarray(values)
+
+    idx = [0]
+    for i, (a, b) in enumerate(zip(edges, edges[1:])):
+        prev = idx[-1]
+        if i + 2 < len(edges):
+            c, d = b, edges[i + 2]
+        else:
+            c, d = n - 1, n
+        if vectorized:
+            avg_x = (c + d - 1) / 2
+            avg_y = float(values[c:d].mean())
+            x = np.arange(a, b)
+            area = np.abs((prev - avg_x) * (values[a:b] - values[prev])
+                          - (prev - x) * (avg_y - values[prev]))
+            idx.append(a + int(np.argmax(area)))
+        else:
+            avg_x = (c + d - 1) / 2
+            avg_y = sum(values[c:d]) / (d - c)
+            idx.append(max(
+                range(a, b),
+                key=lambda x: abs((prev - avg_x) * (values[x] - values[prev])
+                                  - (prev - x) * (avg_y - values[prev]))
+            ))
+    idx.append(n - 1)
+    return [ float(values[i]) for i in idx ], idx
+
+
+REDUCERS = {
+    "mean": reduce_mean,
+    "max": reduce_max,
+    "minmax": reduce_minmax,
+    "lttb": reduce_lttb
+}
+
+
+class SparkCanvas(urwid.TextCanvas):
+    """
+    A TextCanvas made from rows already padded to maxcol whose attribute and
+    character set runs cover them exactly, as built by
+    SparkWidget.make_text_canvas(), so TextCanvas's checks of every run can
+    be skipped.
+    """
+
+    def __init__(self, text, attr, cs, maxcol):
+
+        urwid.Canvas.__init__(self)
+        self._attr = attr
+        self._cs = cs
+        self.cursor = None
+        self._text = text
+        self._maxcol = maxcol
+
 
 class SparkWidget(urwid.Text):
 
+    __slots__ = ("colors", "sparktext", "_lines")
+
+    # a PaletteRegistry to register emitted attributes with, if any
+    palette_registry = None
+
+    # the RenderCache to share markup and canvases through, or None
+    render_cache = render_cache
+
+    # a ColorQuantizer that explicit item colors are snapped with, if any
+    color_quantizer = None
+
+    # number of values drawn in each character cell
+    per_cell = 1
+
+    def get_markup(self, size):
+        """
+        Return the markup to render at the given size.  By default this is
+        sparktext, the markup the widget's text was set to.
+        """
+        return self.sparktext
+
+    def _render_markup(self, markup, size, focus):
+
+        lines = self.get_lines(markup, size)
+        if lines is not None:
+            return self.make_canvas(lines, size[0])
+
+        if markup is self.sparktext:
+            return super(SparkWidget, self).render(size, focus)
+        return urwid.Text(
+            markup or "", align=self.align, wrap=self.wrap, layout=self.layout
+        ).render(size, focus)
+
+    def line_width(self, text):
+        """
+        Return the number of screen columns a line of the widget's text takes.
+        """
+        return urwid.str_util.calc_width(text, 0, len(text))
+
+    def get_lines(self, markup, size):
+        """
+        Split flat markup into lines of (attribute, text) runs, each paired
+        with its width, if the markup can be drawn straight onto a canvas of
+        the given size: every line fits, so no wrapping is needed, and text
+        is UTF-8 encoded for the screen.  Otherwise return None, and the
+        markup is laid out by urwid.Text.
+        """
+
+        if (len(size) != 1
+            or self.layout is not urwid.text_layout.default_layout
+            or urwid.str_util.get_byte_encoding() != "utf8"):
+            return None
+
+        # the last split is kept since rows() and render() both want it
+        cached = getattr(self, "_lines", None)
+        if cached and cached[0] is markup and cached[1] == size:
+            return cached[2]
+
+        lines = [[]]
+        for run in [markup] if isinstance(markup, str) else markup:
+            (attr, text) = run if isinstance(run, tuple) else (None, run)
+            if not isinstance(text, str):
+                return None
+            if "\n" in text:
+                parts = text.split("\n")
+                lines[-1].append((attr, parts[0]))
+                lines.extend([ [(attr, part)] for part in parts[1:] ])
+            else:
+                lines[-1].append((attr, text))
+
+        (maxcol,) = size
+        result = []
+        for line in lines:
+            width = self.line_width("".join([ t for a, t in line ]))
+            if width > maxcol:
+                result = None
+                break
+            result.append((line, width))
+
+        self._lines = (markup, size, result)
+        return result
+
+    def make_canvas(self, lines, maxcol):
+        """
+        Build a canvas maxcol columns wide from lines returned by
+        get_lines(), aligned the same way urwid.Text would align them.
+        """
+
+        text = []
+        attr = []
+        for (runs, width) in lines:
+            row = []
+            row_attr = []
+            for (a, t) in runs:
+                if not t:
+                    continue
+                t = t.encode("utf-8")
+                row.append(t)
+                if row_attr and row_attr[-1][0] == a:
+                    row_attr[-1] = (a, row_attr[-1][1] + len(t))
+                else:
+                    row_attr.append((a, len(t)))
+            text.append(b"".join(row))
+            attr.append(row_attr)
+
+        return self.make_text_canvas(text, attr, [ w for (r, w) in lines ], maxcol)
+
+    def make_text_canvas(self, text, attr, widths, maxcol):
+        """
+        Build a SparkCanvas maxcol columns wide from encoded rows, their
+        attribute runs and their widths, padding each row as urwid.Text would
+        for the widget's alignment.
+        """
+
+        cs = []
+        for i, width in enumerate(widths):
+            pad = maxcol - width
+            if self.align == "right":
+                left = pad
+            elif self.align == "center":
+                left = (pad + 1) // 2
+            else:
+                left = 0
+            right = pad - left
+
+            row_attr = attr[i]
+            if left:
+                if row_attr and row_attr[0][0] is None:
+                    row_attr[0] = (None, row_attr[0][1] + left)
+                else:
+                    row_attr.insert(0, (None, left))
+            if right:
+                if row_attr and row_attr[-1][0] is None:
+                    row_attr[-1] = (None, row_attr[-1][1] + right)
+                else:
+                    row_attr.append((None, right))
+            if pad:
+                text[i] = b"".join([b" " * left, text[i], b" " * right])
+            cs.append([(None, len(text[i]))] if text[i] else [])
+
+        return SparkCanvas(text, attr, cs, maxcol)
+
+    def rows(self, size, focus=False):
+
+        lines = self.get_lines(self.get_markup(size), size)
+        if lines is not None:
+            return len(lines)
+        return super(SparkWidget, self).rows(size, focus)
+
+    def shifted_canvas(self, size):
+        """
+        Return a canvas for size made by updating the widget's previous
+        rendering in place, or None if a full render is needed.
+        """
+        return None
+
+    def caching(self):
+        """
+        Return whether markup and canvases are looked up in and stored to
+        render_cache.  Widgets whose data streams in redraw from markup that
+        hardly ever repeats, so they skip the cache rather than fill it.
+        """
+        return self.render_cache is not None
+
+    def render(self, size, focus=False):
+
+        started = stats and time.perf_counter()
+        canvas = self.shifted_canvas(size)
+
+        if canvas is None:
+            markup = self.get_markup(size)
+            if not self.caching():
+                canvas = self._render_markup(markup, size, focus)
+            else:
+                key = (
+                    "canvas", type(self).__name__,
+                    markup if isinstance(markup, str) else tuple(markup),
+                    size, self.align, self.wrap, self.layout
+                )
+                canvas = self.cache_get(key)
+                if canvas is None:
+                    canvas = self._render_markup(markup, size, focus)
+                    self.render_cache.put(key, canvas)
+
+        if started and stats is not None:
+            stats.add_time(type(self).__name__, "render", started)
+        return canvas
+
+    def cache_get(self, key):
+        """
+        Look key up in the render cache, counting the hit or miss if
+        instrumentation is on.
+        """
+
+        value = self.render_cache.get(key)
+        if stats is not None:
+            stats.add(type(self).__name__,
+                      "cache_misses" if value is None else "cache_hits")
+        return value
+
+    def record_markup(self, glyphs):
+        # markup statistics for the markup just built, if instrumentation is on
+
+        if stats is not None:
+            owner = type(self).__name__
+            stats.add(owner, "markups")
+            stats.add(owner, "markup_runs", len(self.sparktext))
+            stats.add(owner, "markup_glyphs", glyphs)
+
     @staticmethod
     def make_rule_function(scheme):
 
-        rules = scheme["rules"]
-        def rule_function(value):
-            return scheme["colors"].get(
-                next(iter(filter(
-                    lambda rule: all(
-                        OPERATOR_MAP[cond[0]](value, cond[1] if len(cond) > 1 else None)
-                        for cond in [rule]
-                    ), scheme["rules"]
-                )))[-1]
-            )
-        return rule_function
+        return compile_rules(scheme)
 
 
     @staticmethod
@@ -220,6 +1318,9 @@ class SparkWidget(urwid.Text):
         # if not scale_max:
         #     scale_max = v_max
 
+        if scale_max == scale_min:
+            return a
+
         return max(
             a,
             min(
@@ -229,6 +1330,82 @@ class SparkWidget(urwid.Text):
         )
 
 
+    @staticmethod
+    def quantize(values, n, scale_min, scale_max, scale = "linear"):
+        """
+        Return the indexes into a list of n characters of a NumPy array of
+        values, charted on the given scale.  For a linear scale this is a
+        vectorized int(round(normalize(v, 0, n-1, ...))).
+        """
+
+        return get_quantization_table(
+            scale, scale_min, scale_max, n
+        ).indexes(values)
+
+    @staticmethod
+    def coalesce(markup):
+        """
+        Merge adjacent (attribute, text) pairs with the same attribute into a
+        single run.  Pairs with no attribute become plain strings.
+        """
+
+        runs = []
+        for attr, run in groupby(markup, key=operator.itemgetter(0)):
+            text = "".join([ t for a, t in run ])
+            runs.append((attr, text) if attr else text)
+        return runs
+
+    @staticmethod
+    def window(items, offset = 0, length = None):
+        """
+        Return the length items of items starting at offset (all of the rest
+        if length is None).
+
+        Buffer-protocol objects (memoryview, array.array, mmap, bytes, ndarray)
+        are sliced without copying, and read as the numbers of their format.
+        An mmap, such as one of a file of samples, is read as native float64
+        values; to read one as another type, pass memoryview(mmap).cast() of
+        that format instead.  Other sequences are only sliced if offset or
+        length is given.
+        """
+
+        end = None if length is None else offset + length
+        if is_ndarray(items):
+            return items[offset:end]
+
+        try:
+            view = memoryview(items)
+        except TypeError:
+            if not offset and length is None:
+                return items
+            return list(islice(items, offset, end))
+
+        if isinstance(items, mmap.mmap):
+            view = view[:len(view) - len(view) % 8].cast("d")
+        return view[offset:end]
+
+    @staticmethod
+    def as_array(items):
+        """
+        Return items as a one-dimensional NumPy array if NumPy is installed and
+        items is an ndarray, array.array or other buffer-protocol object of
+        numbers, otherwise None.
+        """
+
+        if not is_ndarray(items):
+            try:
+                memoryview(items)
+            except TypeError:
+                return None
+
+        if load_numpy() is None:
+            return None
+
+        values = np.asarray(items)
+        if values.ndim != 1 or values.dtype.kind not in "iuf":
+            return None
+        return values
+
     def parse_scheme(self, scheme):
 
         if isinstance(scheme, dict):
@@ -266,7 +1443,7 @@ class SparkWidget(urwid.Text):
             color = None
         elif callable(self.colors):
             color = self.colors(item)
-        elif isinstance(self.colors, collections.Iterable):
+        elif isinstance(self.colors, collections.abc.Iterable):
             color = self.current_color
             self.next_color()
             return color
@@ -275,6 +1452,21 @@ class SparkWidget(urwid.Text):
 
         return color
 
+    def get_colors(self, values):
+
+        if not self.colors:
+            return repeat(None, len(values))
+        elif isinstance(self.colors, RuleTable) and is_ndarray(values):
+            return self.colors.classify(values).tolist()
+        elif callable(self.colors):
+            return [ self.colors(v) for v in values ]
+        elif isinstance(self.colors, collections.abc.Iterable):
+            colors = list(self.colors)
+            self.colors.rotate(-(len(values) % len(colors)))
+            return [ colors[i % len(colors)] for i in range(len(values)) ]
+        else:
+            raise Exception(self.colors)
+
 
 class SparkColumnWidget(SparkWidget):
     """
@@ -309,71 +1501,1129 @@ class SparkColumnWidget(SparkWidget):
     can be used to restrict or expand the Y-axis.
 
     :param scale_max: Set the maximum for the Y axis. -- see scale_min.
+
+    :param scale: One of "linear" (the default), "log" or "symlog", the
+    scaling of the Y axis.  See QuantizationTable.
+
+    :param max_length: Keep at most this many items.  Items added with append()
+    or extend() beyond this length push the oldest items out of the chart, so
+    the widget can be used as a scrolling, streaming sparkline.
+
+    :param reducer: If set, a series with more values than the width the
+    widget is rendered at is downsampled to fit on one line rather than
+    wrapped.  One of "mean", "max", "minmax" or "lttb" (see REDUCERS), or a
+    function with the same signature as those.  Segment colors follow the
+    input item each output value stands for, except that values are
+    re-classified under a "rules" color scheme.
+
+    :param height: The number of rows the chart is drawn over, giving
+    eight levels per row.  Defaults to 1.
+
+    :param compact: If True, keep the values in an array.array of doubles and
+    each item's attribute as a small integer rather than holding Python
+    objects per item, and only build the markup when the widget is next
+    rendered.  This uses several times less memory per item for long series
+    or many sparklines at the cost of redoing every glyph on each render
+    after a change.  items is then the same array as values, so attributes
+    given in tuple items are not kept there.
+
+    :param offset: Chart items from this index on.
+
+    :param length: Chart at most this many items.
+
+    Items may also be given as a NumPy array, array.array, memoryview, mmap or
+    other buffer-protocol object of plain numbers (an mmap is read as
+    float64), which is read in place rather than copied to a list first (see
+    SparkWidget.window()).  If NumPy is installed, the values are also
+    quantized in a single vectorized pass.
     """
 
+    __slots__ = (
+        "items", "values", "reducer", "scale_min", "scale_max", "scale",
+        "underline", "overline", "max_length", "compact", "height",
+        "_downsampled", "_item_colors", "_glyphs", "_stale",
+        "_attr_ids", "_attrs", "_attr_index", "_dirty", "_scheme",
+        "_min_queue", "_max_queue", "_count", "_bounds",
+        "_scroll", "_text_stale", "_cache_markup"
+    )
+
     chars = BLOCK_VERTICAL
 
+    # zero-width marks drawn on min / max / negative values
+    marks = (
+        "\N{COMBINING DOT BELOW}",
+        "\N{COMBINING TRIPLE UNDERDOT}",
+        "\N{COMBINING THREE DOTS ABOVE}"
+    )
+
     def __init__(self, items,
                  color_scheme = "mono",
                  scale_min = None,
                  scale_max = None,
                  underline = None,
                  overline = None,
+                 max_length = None,
+                 reducer = None,
+                 scale = "linear",
+                 compact = False,
+                 height = 1,
+                 offset = 0,
+                 length = None,
                  *args, **kwargs):
 
-        self.items = items
+        started = stats and time.perf_counter()
         self.colors = self.parse_scheme(color_scheme)
-
+        self._scheme = list(self.colors) if isinstance(self.colors, deque) else None
+        self.reducer = REDUCERS.get(reducer, reducer)
+        # downsampled markup by render width
+        self._downsampled = {}
+
+        self.scale_min = scale_min
+        self.scale_max = scale_max
+        self.scale = scale
         self.underline = underline
         self.overline = overline
+        self.max_length = max_length
+        self.compact = compact
+        self.height = height
+        self.sparktext = []
+        self._text_stale = False
+        self._reset()
+
+        super(SparkColumnWidget, self).__init__("", *args, **kwargs)
+        self._ingest(self.window(items, offset, length))
+        # only the markup of the items given here is worth caching
+        self._cache_markup = True
+        self._refresh()
+
+        if started and stats is not None:
+            stats.add_time(type(self).__name__, "construct", started)
+
+    def _reset(self):
+
+        max_length = self.max_length
+        if self.compact:
+            # attribute ids index _attrs; id 0 means "by color scheme"
+            self.values = array("d")
+            self.items = self.values
+            self._attr_ids = array("H")
+            self._attrs = [None]
+            self._attr_index = {}
+            self._dirty = False
+        else:
+            self.items = deque(maxlen=max_length)
+            self.values = deque(maxlen=max_length)
 
-        self.values = [ i[1] if isinstance(i, tuple) else i for i in self.items ]
+            # per-item colors and glyphs; the last _stale glyphs need quantizing
+            self._item_colors = deque(maxlen=max_length)
+            self._glyphs = deque(maxlen=max_length)
+            self._stale = 0
 
-        v_min = min(self.values)
-        v_max = max(self.values)
+        # monotonic queues of (sequence, value) giving the rolling min / max
+        self._min_queue = deque()
+        self._max_queue = deque()
+        self._count = 0
+        self._bounds = None
+        self._scroll = None
 
+        if self._scheme is not None:
+            self.colors = deque(self._scheme)
 
-        def item_to_glyph(item):
+    @property
+    def v_min(self):
+        return self._min_queue[0][1] if self._min_queue else None
 
+    @property
+    def v_max(self):
+        return self._max_queue[0][1] if self._max_queue else None
+
+    def append(self, item):
+        """
+        Add one item to the end of the chart.
+        """
+        self._push(item)
+        self._refresh()
+
+    def extend(self, items, offset = 0, length = None):
+        """
+        Add a sequence of items to the end of the chart, or the length items
+        from offset on.
+        """
+        self._ingest(self.window(items, offset, length))
+        self._refresh()
+
+    def update(self, items, offset = 0, length = None):
+        """
+        Replace the items charted by the widget, as if it had been created
+        with them.  Used with a window of a shared buffer, this redraws the
+        chart from its current contents without copying the whole buffer.
+        """
+        self._reset()
+        self.extend(items, offset, length)
+
+    def caching(self):
+        return self._cache_markup and self.render_cache is not None
+
+    def _ingest(self, items):
+
+        self._cache_markup = False
+        values = self.as_array(items)
+        if values is None:
+            for item in items:
+                self._push(item)
+        elif len(values):
+            self._push_array(values)
+
+    def _push(self, item):
+
+        self._cache_markup = False
+
+        if isinstance(item, tuple):
+            color = item[0]
+            value = item[1]
+            if self.color_quantizer is not None:
+                color = self.color_quantizer.quantize(color)
+        elif self.compact and callable(self.colors):
+            # classified when the markup is built
             color = None
+            value = item
+        else:
+            color = self.get_color(item)
+            value = item
+
+        seq = self._count
+        self._count += 1
+
+        for queue, dominated in ((self._min_queue, operator.ge),
+                                 (self._max_queue, operator.le)):
+            while queue and dominated(queue[-1][1], value):
+                queue.pop()
+            queue.append((seq, value))
+            if self.max_length:
+                while queue[0][0] <= seq - self.max_length:
+                    queue.popleft()
+
+        if color and self.palette_registry:
+            self.palette_registry.register(color)
+
+        if self.compact:
+            self.values.append(value)
+            attr_id = self._attr_id(color) if isinstance(item, tuple) or color else 0
+            self._attr_ids.append(attr_id)
+            self._trim()
+            return
+
+        if self._scroll is not None and len(self._glyphs) == self.max_length:
+            self._scroll_drop()
+        self.items.append(item)
+        self.values.append(value)
+        self._item_colors.append(color)
+        self._glyphs.append(None)
+        self._stale = min(self._stale + 1, len(self._glyphs))
+
+    def _push_array(self, values):
+
+        if self.compact and callable(self.colors):
+            colors = repeat(None, len(values))
+        else:
+            colors = self.get_colors(values)
+
+        if self.max_length and len(values) > self.max_length:
+            skip = len(values) - self.max_length
+            values = values[skip:]
+            colors = islice(colors, skip, None)
+            self._count += skip
+
+        n = len(values)
+        seq = self._count
+        self._count += n
+
+        for queue, accumulate, dominated, beats in (
+                (self._min_queue, np.minimum, operator.ge, np.less),
+                (self._max_queue, np.maximum, operator.le, np.greater)):
+            # suffix minima (maxima) of the batch are the only new entries
+            # that can ever reach the front of the queue
+            suffix = accumulate.accumulate(values[::-1])[::-1]
+            keep = np.flatnonzero(
+                np.append(beats(values[:-1], suffix[1:]), True)
+            )
+            while queue and dominated(queue[-1][1], suffix[0]):
+                queue.pop()
+            queue.extend(zip((keep + seq).tolist(), values[keep].tolist()))
+            if self.max_length:
+                while queue[0][0] <= seq + n - 1 - self.max_length:
+                    queue.popleft()
+
+        if self.palette_registry:
+            colors = list(colors)
+            for color in set(colors):
+                if color:
+                    self.palette_registry.register(color)
+
+        if self.compact:
+            self.values.frombytes(
+                memoryview(np.ascontiguousarray(values, dtype=float)).cast("B")
+            )
+            ids = [ self._attr_id(color) if color else 0 for color in colors ]
+            self._attr_ids.extend(ids)
+            self._trim()
+            return
+
+        values = values.tolist()
+        self._scroll = None
+        self.items.extend(values)
+        self.values.extend(values)
+        self._item_colors.extend(colors)
+        self._glyphs.extend(repeat(None, n))
+        self._stale = min(self._stale + n, len(self._glyphs))
+
+    def _attr_id(self, attr):
+
+        try:
+            return self._attr_index[attr]
+        except KeyError:
+            if len(self._attrs) > 0xFFFF and self._attr_ids.typecode == "H":
+                # more distinct attributes charted than 16-bit ids can hold
+                self._attr_ids = array("I", self._attr_ids)
+            self._attrs.append(attr)
+            self._attr_index[attr] = len(self._attrs) - 1
+            return len(self._attrs) - 1
+
+    def _trim(self):
+
+        excess = len(self.values) - (self.max_length or len(self.values))
+        if excess > 0:
+            del self.values[:excess]
+            del self._attr_ids[:excess]
+        # attributes of trimmed items stay in the table until it outgrows
+        # both the limit and twice the items, so collecting is amortized
+        if len(self._attrs) > max(COMPACT_ATTR_LIMIT, 2 * len(self._attr_ids)):
+            self._collect_attrs()
+
+    def _collect_attrs(self):
+        # renumber the attributes still charted and drop the rest
+
+        attrs = [None]
+        ids = {0: 0}
+        for attr_id in sorted(set(self._attr_ids)):
+            if attr_id:
+                ids[attr_id] = len(attrs)
+                attrs.append(self._attrs[attr_id])
+        self._attrs = attrs
+        self._attr_index = { attr: i for (i, attr) in enumerate(attrs) if i }
+        self._attr_ids = array(
+            "H" if len(attrs) <= 0x10000 else "I",
+            [ ids[attr_id] for attr_id in self._attr_ids ]
+        )
 
-            if isinstance(item, tuple):
-                color = item[0]
-                value = item[1]
-            else:
-                color = self.get_color(item)
-                value = item
+    def get_bounds(self):
+        """
+        Return the (scale_min, scale_max) the chart is currently drawn with,
+        followed by the min / max values if they are being marked.
+        """
 
-            if self.underline == "negative" and value < 0:
-                glyph = " \N{COMBINING DOT BELOW}"
+        v_min = self.v_min
+        v_max = self.v_max
+
+        return (
+            self.scale_min if self.scale_min is not None else v_min,
+            self.scale_max if self.scale_max is not None else v_max,
+            v_min if self.underline == "min" else None,
+            v_max if self.overline == "max" else None
+        )
+
+    def _refresh(self):
+
+        if self.compact:
+            self._invalidate_markup()
+            return
+
+        v_min = self.v_min
+        v_max = self.v_max
+        bounds = self.get_bounds()
+
+        if bounds != self._bounds:
+            # scale or markers moved, so every glyph has to be redone
+            self._bounds = bounds
+            start = 0
+        else:
+            start = len(self._glyphs) - self._stale
+        self._stale = 0
+        self._downsampled.clear()
+
+        count = len(self.values) - start
+
+        key = None
+        if not start and count and self.caching():
+            key = (
+                "markup", type(self).__name__,
+                digest(array("d", self.values).tobytes(),
+                       "\0".join(map(str, self._item_colors)).encode("utf-8")),
+                bounds
+            ) + self.markup_options()
+            cached = self.cache_get(key)
+            if cached:
+                self._glyphs = deque(cached[0], maxlen=self.max_length)
+                self.sparktext = list(cached[1])
+                self.set_text(self.sparktext)
+                self._make_scroll()
+                return
+
+        started = stats and time.perf_counter()
+        if count >= VECTORIZE_THRESHOLD and load_numpy() is not None:
+            glyphs = self.values_to_glyphs(
+                np.fromiter(islice(self.values, start, None),
+                            dtype=float, count=count),
+                bounds[0], bounds[1], v_min, v_max
+            )
+        else:
+            glyphs = [
+                self.value_to_glyph(v, bounds[0], bounds[1], v_min, v_max)
+                for v in islice(self.values, start, None)
+            ]
+        self._record_quantize(started, count)
+
+        if start:
+            for i in range(count):
+                self._glyphs.pop()
+        else:
+            self._glyphs.clear()
+        self._glyphs.extend(glyphs)
+
+        if start and self._scroll is not None:
+            self._scroll_extend(islice(self._item_colors, start, None), glyphs)
+        else:
+            self._set_markup()
+
+        if key is not None:
+            self.render_cache.put(key, (tuple(self._glyphs), tuple(self.sparktext)))
+
+    def _requantize(self, values, idx):
+        # redo every glyph from glyph indexes computed elsewhere (SparkGroup)
+
+        if self.compact:
+            self._invalidate_markup()
+            return
+
+        self._bounds = self.get_bounds()
+        self._stale = 0
+        self._downsampled.clear()
+
+        self._glyphs.clear()
+        self._glyphs.extend(self.values_to_glyphs(
+            values, self._bounds[0], self._bounds[1], self.v_min, self.v_max,
+            idx=idx
+        ))
+        self._set_markup()
+
+    def markup_options(self):
+        """
+        Return the options other than the values and bounds that the markup
+        depends on, for render cache keys.
+        """
+        return (self.scale, self.underline, self.overline, self.height)
+
+    def _set_markup(self):
+
+        self.sparktext = self.make_markup(self._item_colors, self._glyphs)
+        self._text_stale = False
+        self.set_text(self.sparktext or "")
+        self.record_markup(len(self._glyphs) * self.height)
+        self._make_scroll()
+
+    def _make_scroll(self):
+        # single-row charts keep their markup runs, the attribute runs and
+        # bytes of their canvas row and the byte length of each glyph, so a
+        # chart that scrolls on an unchanged scale is updated at both ends
+        # rather than redrawn; see _scroll_drop(), _scroll_extend()
+
+        if self.height != 1 or self.per_cell != 1:
+            self._scroll = None
+            return
+
+        runs = deque(self.sparktext)
+        byte_runs = deque()
+        for run in runs:
+            (attr, text) = run if isinstance(run, tuple) else (None, run)
+            byte_runs.append((attr, len(text.encode("utf-8"))))
+        self._scroll = (
+            runs, byte_runs,
+            bytearray("".join([ g for g in self._glyphs ]).encode("utf-8")),
+            deque([ len(g.encode("utf-8")) for g in self._glyphs ])
+        )
+
+    def _scroll_drop(self):
+        # take the oldest glyph, about to be pushed out, off the front
+
+        glyph = self._glyphs[0]
+        if glyph is None:
+            self._scroll = None
+            return
+
+        (runs, byte_runs, row, lengths) = self._scroll
+        size = lengths.popleft()
+        del row[:size]
+
+        (attr, n) = byte_runs[0]
+        if n == size:
+            runs.popleft()
+            byte_runs.popleft()
+        else:
+            text = runs[0][1] if attr else runs[0]
+            runs[0] = (attr, text[len(glyph):]) if attr else text[len(glyph):]
+            byte_runs[0] = (attr, n - size)
+
+    def _scroll_extend(self, colors, glyphs):
+        # add newly quantized glyphs to the end and publish the markup, leaving
+        # urwid.Text to be updated when its text is asked for
+
+        (runs, byte_runs, row, lengths) = self._scroll
+        for color, glyph in zip(colors, glyphs):
+            encoded = glyph.encode("utf-8")
+            row += encoded
+            lengths.append(len(encoded))
+            if byte_runs and byte_runs[-1][0] == color:
+                text = runs[-1][1] if color else runs[-1]
+                runs[-1] = (color, text + glyph) if color else text + glyph
+                byte_runs[-1] = (color, byte_runs[-1][1] + len(encoded))
             else:
+                runs.append((color, glyph) if color else glyph)
+                byte_runs.append((color, len(encoded)))
 
+        self.sparktext = list(runs)
+        self._text_stale = True
+        self._invalidate()
+        self.record_markup(len(glyphs))
 
-                # idx = scale_value(value, scale_min=scale_min, scale_max=scale_max)
-                idx = self.normalize(
-                    value, 0, len(self.chars)-1,
-                    scale_min if scale_min else v_min,
-                    scale_max if scale_max else v_max)
+    def _scrolling(self, size):
+        # whether the scroll state can be drawn as is at size
 
-                glyph = self.chars[int(round(idx))]
+        return (self._scroll is not None
+                and len(size) == 1
+                and len(self.values) <= size[0]
+                and not self._downsampling(size)
+                and self.layout is urwid.text_layout.default_layout
+                and urwid.str_util.get_byte_encoding() == "utf8")
 
-                if self.underline == "min" and value == v_min:
-                    glyph = "%s\N{COMBINING TRIPLE UNDERDOT}" %(glyph)
+    def shifted_canvas(self, size):
 
-                if self.overline == "max" and value == v_max:
-                    glyph = "%s\N{COMBINING THREE DOTS ABOVE}" %(glyph)
+        if not self._scrolling(size):
+            return None
+        (runs, byte_runs, row, lengths) = self._scroll
+        return self.make_text_canvas(
+            [bytes(row)], [list(byte_runs)], [len(lengths)], size[0]
+        )
 
-            if color:
-                return (color, glyph)
+    def _record_quantize(self, started, count):
+
+        if started and stats is not None:
+            stats.add_time(type(self).__name__, "quantize", started)
+            stats.add(type(self).__name__, "quantized", count)
+
+    def _invalidate_markup(self):
+
+        self._dirty = True
+        self._downsampled.clear()
+        self._invalidate()
+
+    def _build_markup(self):
+        # compact mode: quantize and color every item from the stored arrays
+
+        self._dirty = False
+        self._bounds = bounds = self.get_bounds()
+        v_min = self.v_min
+        v_max = self.v_max
+        count = len(self.values)
+
+        key = None
+        if count and self.caching():
+            key = (
+                "markup", "compact", type(self).__name__,
+                digest(self.values.tobytes(), self._attr_ids.tobytes(),
+                       "\0".join(map(str, self._attrs)).encode("utf-8")),
+                bounds
+            ) + self.markup_options()
+            cached = self.cache_get(key)
+            if cached:
+                self.sparktext = list(cached)
+                self.set_text(self.sparktext)
+                return
+
+        started = stats and time.perf_counter()
+        if count >= VECTORIZE_THRESHOLD and load_numpy() is not None:
+            values = np.frombuffer(self.values, dtype=float)
+            glyphs = self.values_to_glyphs(
+                values, bounds[0], bounds[1], v_min, v_max
+            )
+        else:
+            values = self.values
+            glyphs = [
+                self.value_to_glyph(v, bounds[0], bounds[1], v_min, v_max)
+                for v in values
+            ]
+        self._record_quantize(started, count)
+
+        self.sparktext = self.make_markup(self._compact_colors(values), glyphs)
+        del values
+        self.set_text(self.sparktext or "")
+        self.record_markup(count * self.height)
+
+        if self.palette_registry:
+            self.palette_registry.register_markup(self.sparktext)
+        if key is not None:
+            self.render_cache.put(key, tuple(self.sparktext))
+
+    def _compact_colors(self, values, idx = None):
+        # the attributes of values (the items at idx, if given) in compact mode
+
+        ids = self._attr_ids if idx is None else [ self._attr_ids[i] for i in idx ]
+        colors = [ self._attrs[i] for i in ids ]
+        if callable(self.colors):
+            derived = self.get_colors(values)
+            colors = [ d if not i else c
+                       for i, c, d in zip(ids, colors, derived) ]
+        return colors
+
+    def get_text(self):
+
+        if self.compact and self._dirty:
+            self._build_markup()
+        elif self._text_stale:
+            self._text_stale = False
+            self.set_text(self.sparktext or "")
+        return super(SparkColumnWidget, self).get_text()
+
+    def _downsampling(self, size):
+        return (self.reducer and len(size) == 1
+                and len(self.values) > size[0] * self.per_cell)
+
+    def get_markup(self, size):
+
+        if not self._downsampling(size):
+            if self.compact and self._dirty:
+                self._build_markup()
+            return self.sparktext
+
+        (maxcol,) = size
+        try:
+            return self._downsampled[maxcol]
+        except KeyError:
+            pass
+
+        vectorize = (len(self.values) >= VECTORIZE_THRESHOLD
+                     and load_numpy() is not None)
+        if self.compact:
+            self._bounds = self.get_bounds()
+            if vectorize:
+                values = np.frombuffer(self.values, dtype=float)
             else:
+                values = self.values
+        elif vectorize:
+            values = np.fromiter(self.values, dtype=float, count=len(self.values))
+        else:
+            values = list(self.values)
+
+        reduced, idx = self.reducer(values, maxcol * self.per_cell)
+        del values
+
+        scale_min, scale_max = self._bounds[:2]
+        v_min = self.v_min
+        v_max = self.v_max
+
+        if self.compact:
+            colors = self._compact_colors(reduced, idx)
+        else:
+            rules = callable(self.colors)
+            item_colors = list(self._item_colors)
+            colors = [
+                self.colors(value)
+                if rules and not isinstance(self.items[i], tuple)
+                else item_colors[i]
+                for value, i in zip(reduced, idx)
+            ]
+
+        markup = self.make_markup(colors, [
+            self.value_to_glyph(value, scale_min, scale_max, v_min, v_max)
+            for value in reduced
+        ])
+        self._downsampled[maxcol] = markup
+        return markup
+
+    def rows(self, size, focus=False):
+
+        if self._scrolling(size):
+            return 1
+        if self._downsampling(size) and self.get_lines(
+                self.get_markup(size), size) is None:
+            return self.height
+        return super(SparkColumnWidget, self).rows(size, focus)
+
+    def make_markup(self, colors, glyphs):
+        """
+        Return the coalesced markup for per-item colors and glyphs.  For a
+        chart more than one row high the glyphs are tuples of one glyph per
+        row, top row first, and the rows are separated by newlines.
+        """
+
+        if self.height == 1:
+            return self.coalesce(zip(colors, glyphs))
+
+        colors = list(colors)
+        markup = []
+        for row in range(self.height):
+            if row:
+                markup.append((None, "\n"))
+            markup.extend(zip(colors, [ g[row] for g in glyphs ]))
+        return self.coalesce(markup)
+
+    def line_width(self, text):
+        # every glyph is one column wide apart from the combining marks
+        return len(text) - sum([ text.count(mark) for mark in self.marks ])
+
+    def value_to_glyph(self, value, scale_min, scale_max, v_min, v_max):
+
+        if self.underline == "negative" and value < 0:
+            glyph = " \N{COMBINING DOT BELOW}"
+            if self.height == 1:
                 return glyph
+            return (" ",) * (self.height - 1) + (glyph,)
+
+        n = len(self.chars)
+        index = get_quantization_table(
+            self.scale, scale_min, scale_max, n * self.height
+        ).index(value)
+
+        glyphs = [
+            self.chars[min(index - n * row, n - 1)] if index >= n * row else " "
+            for row in reversed(range(self.height))
+        ]
+
+        if self.underline == "min" and value == v_min:
+            glyphs[-1] = "%s\N{COMBINING TRIPLE UNDERDOT}" %(glyphs[-1])
+
+        if self.overline == "max" and value == v_max:
+            glyphs[0] = "%s\N{COMBINING THREE DOTS ABOVE}" %(glyphs[0])
+
+        return glyphs[0] if self.height == 1 else tuple(glyphs)
+
+    def values_to_glyphs(self, values, scale_min, scale_max, v_min, v_max,
+                         idx = None):
+        """
+        Vectorized value_to_glyph() for a NumPy array of values.  idx, if
+        given, holds the already quantized glyph indexes of the values.
+        """
+
+        load_numpy()
+        n = len(self.chars)
+        if idx is None:
+            idx = self.quantize(values, n * self.height,
+                                scale_min, scale_max, self.scale)
+
+        chars = np.array(self.chars, dtype=object)
+        rows = []
+        for row in reversed(range(self.height)):
+            level = idx - n * row
+            glyphs = chars[np.clip(level, 0, n - 1)]
+            glyphs[level < 0] = " "
+            rows.append(glyphs)
+
+        if self.underline == "min":
+            rows[-1][values == v_min] += "\N{COMBINING TRIPLE UNDERDOT}"
+
+        if self.overline == "max":
+            rows[0][values == v_max] += "\N{COMBINING THREE DOTS ABOVE}"
+
+        if self.underline == "negative":
+            negative = values < 0
+            for glyphs in rows[:-1]:
+                glyphs[negative] = " "
+            rows[-1][negative] = " \N{COMBINING DOT BELOW}"
+
+        if self.height == 1:
+            return rows[0].tolist()
+        return list(zip(*[ glyphs.tolist() for glyphs in rows ]))
+
+
+class SparkDotWidget(SparkColumnWidget):
+    """
+    A denser SparkColumnWidget that draws two values per character cell,
+    either as columns of braille dots (four levels per row) or of quadrant
+    blocks (two levels per row).
+
+    :param style: "braille" (the default) or "halfblock", see DOT_STYLES.
+
+    Other parameters are as for SparkColumnWidget, except that underline and
+    overline markers are not drawn.  Each cell is colored like the taller of
+    its two values, so "rules" color schemes still show the values that
+    cross a threshold.
+    """
+
+    __slots__ = ("style", "cells")
+
+    per_cell = 2
+
+    def __init__(self, items, style = "braille", *args, **kwargs):
+
+        if style not in DOT_STYLES:
+            raise Exception("Unknown dot style: %s" %(style))
+        self.style = style
+        self.cells = DOT_STYLES[style]
+        super(SparkDotWidget, self).__init__(items, *args, **kwargs)
 
-        self.sparktext = [
-            item_to_glyph(i)
-            for i in self.items
+    @property
+    def levels(self):
+        # the number of levels per cell row
+        return len(self.cells) - 1
+
+    def markup_options(self):
+        return super(SparkDotWidget, self).markup_options() + (self.style,)
+
+    def line_width(self, text):
+        return len(text)
+
+    def value_to_glyph(self, value, scale_min, scale_max, v_min, v_max):
+        # glyphs are quantized levels until make_markup() pairs them up
+        return get_quantization_table(
+            self.scale, scale_min, scale_max, self.levels * self.height
+        ).index(value)
+
+    def values_to_glyphs(self, values, scale_min, scale_max, v_min, v_max,
+                         idx = None):
+
+        if idx is None:
+            idx = self.quantize(values, self.levels * self.height,
+                                scale_min, scale_max, self.scale)
+        return idx.tolist()
+
+    def make_markup(self, colors, glyphs):
+        """
+        Return the coalesced markup for per-item colors and quantized levels,
+        drawing the values in pairs.
+        """
+
+        colors = list(colors)
+        levels = list(glyphs)
+        if len(levels) % 2:
+            colors.append(None)
+            levels.append(-1)
+        n = self.levels
+
+        markup = []
+        if len(levels) >= VECTORIZE_THRESHOLD and load_numpy() is not None:
+            fill = np.array(levels) + 1
+            (left, right) = (fill[0::2], fill[1::2])
+            cells = np.array([ list(row) for row in self.cells ], dtype=object)
+            colors = np.array(colors, dtype=object)
+            colors = np.where(left >= right, colors[0::2], colors[1::2]).tolist()
+            for row in reversed(range(self.height)):
+                if markup:
+                    markup.append((None, "\n"))
+                markup.extend(zip(colors, cells[
+                    np.clip(left - n * row, 0, n), np.clip(right - n * row, 0, n)
+                ].tolist()))
+            return self.coalesce(markup)
+
+        pairs = list(zip(levels[0::2], levels[1::2]))
+        colors = [
+            colors[i] if left >= right else colors[i + 1]
+            for i, (left, right) in zip(range(0, len(levels), 2), pairs)
         ]
-        super(SparkColumnWidget, self).__init__(self.sparktext, *args, **kwargs)
+        for row in reversed(range(self.height)):
+            if markup:
+                markup.append((None, "\n"))
+            base = n * row - 1
+            markup.extend(zip(colors, [
+                self.cells[min(max(left - base, 0), n)][min(max(right - base, 0), n)]
+                for left, right in pairs
+            ]))
+        return self.coalesce(markup)
+
+
+class SparkHistogramWidget(SparkColumnWidget):
+    """
+    A streaming histogram drawn as a column chart, one column per bin.
+
+    Samples added with append() / extend() are counted into fixed bins at a
+    constant cost per sample, and memory is bounded by the number of bins.
+    The chart is drawn from the counts through the column glyph path the
+    next time it is rendered, so it can be fed many samples between screen
+    updates (e.g. through a SampleFeeder).
+
+    :param items: Initial samples.
+
+    :param bin_min: The lower edge of the first bin.
+
+    :param bin_max: The upper edge of the last bin.  Samples outside
+    [bin_min, bin_max) are counted in the first or last bin, and NaNs are
+    ignored.
+
+    :param bins: The number of bins.
+
+    :param bin_scale: "linear" (the default) or "log" for logarithmically
+    spaced bins, which need a positive bin_min.
 
+    :param half_life: If set, the counts decay exponentially: the weight of
+    a sample halves with every half_life samples added after it.
+
+    :param window_length: If set, only about the last window_length samples
+    are counted.  They are kept as a ring of panes (partial histograms) that
+    expire a pane at a time, so between window_length - window_length / panes
+    and window_length samples are counted.
+
+    :param panes: The number of panes the window is split into.
+
+    Other keyword arguments are passed on to SparkColumnWidget, except that
+    scale_min defaults to 0.  Samples may also be given as a buffer of
+    numbers with offset / length, and are then binned with NumPy if it is
+    installed.
+    """
+
+    __slots__ = (
+        "bin_min", "bin_max", "bins", "bin_scale", "half_life", "window_length",
+        "_origin", "_factor", "_counts", "_weight", "_growth",
+        "_panes", "_pane_size", "_pane_count", "_pending"
+    )
+
+    def __init__(self, items, bin_min, bin_max,
+                 bins = HISTOGRAM_BINS,
+                 bin_scale = "linear",
+                 half_life = None,
+                 window_length = None,
+                 panes = HISTOGRAM_PANES,
+                 offset = 0,
+                 length = None,
+                 *args, **kwargs):
+
+        if bin_scale == "log":
+            if not bin_min > 0:
+                raise Exception("Log bins need a positive bin_min: %s" %(bin_min))
+            self._origin = math.log(bin_min)
+            span = math.log(bin_max) - self._origin if bin_max > 0 else 0
+        elif bin_scale == "linear":
+            self._origin = bin_min
+            span = bin_max - bin_min
+        else:
+            raise Exception("Unknown bin scale: %s" %(bin_scale))
+        if not span > 0:
+            raise Exception("Empty bin range: %s, %s" %(bin_min, bin_max))
+        if half_life and window_length:
+            raise Exception("A histogram can either decay or expire samples")
+
+        self.bin_min = bin_min
+        self.bin_max = bin_max
+        self.bins = bins
+        self.bin_scale = bin_scale
+        self.half_life = half_life
+        self.window_length = window_length
+        self._factor = bins / span
+        self._counts = array("d", [0.0]) * bins
+        self._weight = 1.0
+        self._growth = 2 ** (1 / half_life) if half_life else None
+        # panes, newest last, each counting up to _pane_size samples
+        self._panes = deque([ array("d", [0.0]) * bins ]) if window_length else None
+        self._pane_size = max(1, -(-window_length // panes)) if window_length else None
+        self._pane_count = 0
+        self._pending = False
+
+        kwargs.setdefault("scale_min", 0)
+        kwargs["max_length"] = bins
+        super(SparkHistogramWidget, self).__init__(
+            [], *args, **kwargs
+        )
+        self.extend(items, offset, length)
+
+    def bin_index(self, value):
+        """
+        Return the index of the bin value is counted in, or None for NaN.
+        """
+
+        if value != value:
+            return None
+        if self.bin_scale == "log":
+            if value <= 0:
+                return 0
+            value = math.log(value)
+        x = (value - self._origin) * self._factor
+        if x < 0:
+            return 0
+        if x >= self.bins:
+            return self.bins - 1
+        return int(x)
+
+    @property
+    def edges(self):
+        """
+        The bins + 1 bin edges, from bin_min to bin_max.
+        """
+        if self.bin_scale == "log":
+            return [ math.exp(self._origin + i / self._factor)
+                     for i in range(self.bins + 1) ]
+        return [ self._origin + i / self._factor for i in range(self.bins + 1) ]
+
+    @property
+    def counts(self):
+        """
+        The (decayed) count of samples in each bin.
+        """
+        scale = self._weight / self._growth if self._growth else 1.0
+        return [ c / scale for c in self._counts ]
+
+    @property
+    def total(self):
+        """
+        The (decayed) number of samples counted.
+        """
+        return sum(self.counts)
+
+    def append(self, item):
+        """
+        Count one sample.
+        """
+        self._add(item)
+        self._mark()
+
+    def extend(self, items, offset = 0, length = None):
+        """
+        Count a sequence of samples, or the length samples from offset on.
+        """
+
+        items = self.window(items, offset, length)
+        values = self.as_array(items)
+        if values is None:
+            for item in items:
+                self._add(item)
+        elif len(values):
+            self._add_array(values)
+        self._mark()
+
+    def update(self, items, offset = 0, length = None):
+        """
+        Replace the samples counted with items.
+        """
+        self.clear()
+        self.extend(items, offset, length)
+
+    def clear(self):
+        """
+        Forget all samples.
+        """
+
+        self._counts = array("d", [0.0]) * self.bins
+        self._weight = 1.0
+        if self.window_length:
+            self._panes = deque([ array("d", [0.0]) * self.bins ])
+            self._pane_count = 0
+        self._mark()
+
+    def _mark(self):
+        # counts changed; redraw when next rendered
+
+        if not self._pending:
+            self._pending = True
+            self._invalidate()
+
+    def _add(self, value):
+
+        i = self.bin_index(value)
+        if i is None:
+            return
+        self._counts[i] += self._weight
+
+        if self._growth:
+            self._weight *= self._growth
+            if self._weight > HISTOGRAM_MAX_WEIGHT:
+                self._rescale()
+        elif self.window_length:
+            self._panes[-1][i] += 1
+            self._pane_count += 1
+            if self._pane_count >= self._pane_size:
+                self._next_pane()
+
+    def _rescale(self):
+        # bring decayed counts back to a scale where the last sample weighs 1
+
+        scale = self._weight / self._growth
+        self._counts = array("d", [ c / scale for c in self._counts ])
+        self._weight = self._growth
+
+    def _next_pane(self):
+        # start a new pane, expiring the oldest once there are enough
+
+        if len(self._panes) * self._pane_size >= self.window_length:
+            oldest = self._panes.popleft()
+            for i, c in enumerate(oldest):
+                if c:
+                    self._counts[i] -= c
+                    oldest[i] = 0.0
+        else:
+            oldest = array("d", [0.0]) * self.bins
+        self._panes.append(oldest)
+        self._pane_count = 0
+
+    def _add_array(self, values):
+
+        values = values.astype(float)
+        values = values[~np.isnan(values)]
+        if self.bin_scale == "log":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.log(values)
+        x = np.nan_to_num((values - self._origin) * self._factor,
+                          nan=0, posinf=self.bins - 1, neginf=0)
+        idx = np.clip(x, 0, self.bins - 1).astype(int)
+        counts = np.frombuffer(self._counts, dtype=float)
+
+        if self._growth:
+            # decay everything to the scale of the last sample of the batch
+            n = len(idx)
+            decay = 1 / self._growth
+            counts *= decay ** n / (self._weight / self._growth)
+            counts += np.bincount(idx, weights=decay ** np.arange(n - 1, -1, -1),
+                                  minlength=self.bins)
+            self._weight = self._growth
+        elif self.window_length:
+            while len(idx):
+                take = self._pane_size - self._pane_count
+                batch = np.bincount(idx[:take], minlength=self.bins)
+                counts += batch
+                np.frombuffer(self._panes[-1], dtype=float)[:] += batch
+                self._pane_count += len(idx[:take])
+                idx = idx[take:]
+                if self._pane_count >= self._pane_size:
+                    del counts
+                    self._next_pane()
+                    counts = np.frombuffer(self._counts, dtype=float)
+        else:
+            counts += np.bincount(idx, minlength=self.bins)
+        del counts
+
+    def _redraw(self):
+        # chart the current counts, one item per bin
+
+        self._pending = False
+        counts = array("d", self.counts)
+        self._reset()
+        self._ingest(counts)
+        self._refresh()
+
+    def get_text(self):
+        if self._pending:
+            self._redraw()
+        return super(SparkHistogramWidget, self).get_text()
+
+    def get_markup(self, size):
+        if self._pending:
+            self._redraw()
+        return super(SparkHistogramWidget, self).get_markup(size)
+
+    def rows(self, size, focus=False):
+        if self._pending:
+            self._redraw()
+        return super(SparkHistogramWidget, self).rows(size, focus)
+
+    def render(self, size, focus=False):
+        if self._pending:
+            self._redraw()
+        return super(SparkHistogramWidget, self).render(size, focus)
 
 
 class SparkBarWidget(SparkWidget):
@@ -391,26 +2641,189 @@ class SparkBarWidget(SparkWidget):
 
     :param color_scheme: A string or dictionary containing the name of or
     definition of a color scheme for the widget.
+
+    :param offset: Chart items from this index on.
+
+    :param length: Chart at most this many items.
+
+    Items may also be given as a buffer-protocol object of plain numbers, as
+    for SparkColumnWidget.  Items can be changed afterwards with set_value()
+    and update(), which lay the bar out again only from the first segment
+    that changed.
+
+    If SparkWidget.color_quantizer is set, segment colors are snapped to its
+    colors (see ColorQuantizer).
     """
 
+    __slots__ = (
+        "items", "width", "label_color",
+        "_normalize", "_source", "_scheme", "_filtered", "_total", "_segments",
+        "_cache_markup"
+    )
+
     chars = BLOCK_HORIZONTAL
 
+    @staticmethod
+    def filter_items(items, width):
+        """
+        Return the items that are large enough to display, i.e. what is left
+        after repeatedly dropping the first item worth less than one
+        character of the remaining total.
+
+        Dropping a positive value only lowers that threshold, so items already
+        passed over can never become droppable and a single in-order pass
+        gives the same result.  Only dropping a negative value raises the
+        threshold, in which case the pass starts over.  The threshold is
+        kept as a running total, which is re-summed in order whenever an item
+        is within its rounding error of it.
+        """
+
+        values = [ i[1] if isinstance(i, tuple) else i for i in items ]
+        keep = [True] * len(values)
+        total = sum(values)
+        # bound on how far the running total can drift from an in-order sum
+        # of the remaining values, both being off the exact sum by at most
+        # one rounding per addition of the largest partial sum
+        slack = (4 * (len(values) + 1) * sys.float_info.epsilon
+                 * sum(abs(v) for v in values) / width)
+
+        i = 0
+        while i < len(values):
+            if keep[i]:
+                v = values[i]
+                charwidth = total / width
+                if abs(v - charwidth) <= slack:
+                    # too close to call with a running total, so sum the
+                    # remaining values in order
+                    total = sum(x for x, k in zip(values, keep) if k)
+                    charwidth = total / width
+                if v < charwidth:
+                    keep[i] = False
+                    total -= v
+                    if v < 0:
+                        i = 0
+                        continue
+            i += 1
+
+        return [ item for item, k in zip(items, keep) if k ]
+
     def __init__(self, items, width,
                  color_scheme = "mono",
                  label_color = None,
                  normalize = None,
+                 offset = 0,
+                 length = None,
                  *args, **kwargs):
 
+        started = stats and time.perf_counter()
+        items = self.read_items(items, offset, length)
         self.items = items
         self.width = width
         self.label_color = label_color
+        self.colors = self.parse_scheme(color_scheme)
+
+        self._normalize = normalize
+        self._source = list(items)
+        self._scheme = list(self.colors) if isinstance(self.colors, deque) else None
+        # filtered items, their total and per-segment layout state, see _layout_segments()
+        self._filtered = None
+        self._total = None
+        self._segments = None
+        self._cache_markup = True
+
+        cached = None
+        if self.caching():
+            key = (
+                "markup", type(self).__name__,
+                digest(repr(items).encode("utf-8")),
+                width, repr(color_scheme), label_color, normalize,
+                self.color_quantizer and self.color_quantizer.colors
+            )
+            cached = self.cache_get(key)
+
+        if cached:
+            normalized_items, sparktext = cached
+            if normalized_items is not None:
+                self.items = list(normalized_items)
+            self.sparktext = list(sparktext)
+        else:
+            self.sparktext = self._build(normalize)
+            self.record_markup(self.width)
+            if self.caching():
+                self.render_cache.put(key, (
+                    tuple(self.items) if normalize else None,
+                    tuple(self.sparktext)
+                ))
+
+        if self.palette_registry:
+            self.palette_registry.register_markup(self.sparktext)
+
+        super(SparkBarWidget, self).__init__(self.sparktext or "", *args, **kwargs)
+
+        if started and stats is not None:
+            stats.add_time(type(self).__name__, "construct", started)
+
+    def set_value(self, index, value):
+        """
+        Change the value of the item at index, keeping its attribute and
+        label if it is a tuple.
+        """
+
+        item = self._source[index]
+        if isinstance(item, tuple):
+            item = item[:1] + (value,) + item[2:]
+        else:
+            item = value
+        self._source[index] = item
+        self._update()
+
+    def update(self, items, offset = 0, length = None):
+        """
+        Replace the items charted by the widget, or with the length items
+        from offset on.
+        """
+
+        self._source = list(self.read_items(items, offset, length))
+        self._update()
+
+    def read_items(self, items, offset = 0, length = None):
+        """
+        Return the window of items to chart, with the values of a buffer
+        read into a list in one pass.
+        """
+
+        items = self.window(items, offset, length)
+        if not isinstance(items, (list, tuple)) and hasattr(items, "tolist"):
+            return items.tolist()
+        return items
+
+    def caching(self):
+        return self._cache_markup and self.render_cache is not None
+
+    def _update(self):
+
+        started = stats and time.perf_counter()
+        self._cache_markup = False
+        if not self._normalize:
+            self.items = list(self._source)
+        self.sparktext = self._build(self._normalize)
+        self.set_text(self.sparktext or "")
+        self.record_markup(self.width)
+
+        if started and stats is not None:
+            stats.add_time(type(self).__name__, "update", started)
+
+        if self.palette_registry:
+            self.palette_registry.register_markup(self.sparktext)
+
+    def _build(self, normalize):
 
         values = None
         total = None
 
         if normalize:
             values = [ item[1] if isinstance(item, tuple) else item
-                       for item in self.items ]
+                       for item in self._source ]
             v_min = min(values)
             v_max = max(values)
             # print v
@@ -425,48 +2838,62 @@ class SparkBarWidget(SparkWidget):
                 tuple([item[0]] + [values[i]] + (list(item[2:]) if len(item) > 2 else []))
                 if isinstance(item, tuple)
                 else values[i]
-                for i, item in enumerate(self.items) ]
+                for i, item in enumerate(self._source) ]
             # print self.items
             # raise Exception
             # print v
 
 
-        filtered_items = [ i for i in self.items ]
-        # ugly brute force method to eliminate values too small to display
-        while True:
-            values = [ i[1] if isinstance(i, tuple) else i
-                       for i in filtered_items ]
-
-            if not len(values):
-                raise Exception(self.items)
-            total = sum(values)
-            v_min = min(values)
-            v_max = max(values)
-            charwidth = total / self.width
-            try:
-                i = next(iter(filter(
-                    lambda i: (i[1] if isinstance(i, tuple) else i) < charwidth,
-                    filtered_items)))
-                filtered_items.remove(i)
-            except StopIteration:
-                break
-
+        filtered_items = self.filter_items(self.items, self.width)
+        if not filtered_items:
+            raise Exception(self.items)
+        total = sum(i[1] if isinstance(i, tuple) else i
+                    for i in filtered_items)
+
+        # with the same total every segment before the first changed one is
+        # laid out exactly as before
+        start = 0
+        if self._segments is not None and total == self._total:
+            for start, (old, new) in enumerate(
+                    zip(self._filtered, filtered_items + [None])):
+                if old != new:
+                    break
+            else:
+                start = len(self._filtered)
+            start = min(start, len(self._segments) - 1)
 
+        self._filtered = filtered_items
+        self._total = total
+        return self._layout_segments(start)
 
-        self.colors = self.parse_scheme(color_scheme)
+    def _layout_segments(self, start):
+        # lay out segments from start on, resuming from the saved state of
+        # the one before; each segment keeps (state, markup, label key, label)
 
+        total = self._total
         charwidth = total / self.width
         stepwidth = charwidth / len(self.chars)
 
-        self.sparktext = []
-
-        position = 0
-        carryover = 0
+        if start:
+            (position, carryover, lastcolor, rotation) = self._segments[start][0]
+        else:
+            position = 0
+            carryover = 0
+            lastcolor = None
+            rotation = 0
         nchars = len(self.chars)
-        lastcolor = None
 
-        for i, item in enumerate(filtered_items):
+        if self._scheme is not None:
+            self.colors = deque(self._scheme)
+            self.colors.rotate(-rotation)
 
+        previous = self._segments or []
+        segments = previous[:start]
+
+        for i, item in enumerate(self._filtered[start:], start):
+
+            state = (position, carryover, lastcolor, rotation)
+            sparktext = []
             text = ""
             textcolor = self.label_color or DEFAULT_LABEL_COLOR
             label = None
@@ -487,14 +2914,17 @@ class SparkBarWidget(SparkWidget):
                 fcolor = bcolor = self.current_color
                 # bcolor = self.current_color
                 self.next_color()
+                rotation += 1
                 v = item
 
 
+            key = None
             if label:
-                text += label.format(
-                    value=v,
-                    pct=int(round(v/total*100, 0))
-                )
+                key = (label, v, int(round(v/total*100, 0)))
+                if i < len(previous) and previous[i][2] == key:
+                    text += previous[i][3]
+                else:
+                    text += label.format(value=v, pct=key[2])
 
 
             b = position + v + carryover
@@ -503,7 +2933,7 @@ class SparkBarWidget(SparkWidget):
                 char = self.chars[idx]
                 c = ("%s:%s" %(lastcolor, bcolor), char)
                 position += charwidth
-                self.sparktext.append(c)
+                sparktext.append(c)
 
             rangewidth = b - position# + carryover
             rangechars = int(round(rangewidth/charwidth))
@@ -527,10 +2957,563 @@ class SparkBarWidget(SparkWidget):
                 chars = " "*rangechars
             position += rangechars*charwidth
 
-            self.sparktext.append(("%s:%s" %(fcolor, bcolor), chars))
+            sparktext.append(("%s:%s" %(fcolor, bcolor), chars))
             carryover = b - position
             lastcolor = bcolor
 
-        if not self.sparktext:
-            self.sparktext = ""
-        super(SparkBarWidget, self).__init__(self.sparktext, *args, **kwargs)
+            segments.append((state, sparktext, key, text))
+
+        self._segments = segments
+        markup = [ c for (state, sparktext, key, text) in segments for c in sparktext ]
+        if self.color_quantizer is not None:
+            markup = [ (self.color_quantizer.quantize(attr), text)
+                       for (attr, text) in markup ]
+        return self.coalesce(markup)
+
+
+class SparkGroup(urwid.Pile):
+    """
+    A pile of SparkColumnWidgets drawn on one shared Y-axis scale.
+
+    The scale is worked out once for the whole group rather than per widget.
+    When it changes, every row is requantized together in a single batched
+    pass; otherwise an update only touches the rows it adds items to.
+
+    :param series: A list of item lists, one per row.  See SparkColumnWidget
+    for the form of the items.
+
+    :param scale_min: Fix the minimum of the shared scale.  By default it is
+    the minimum value across all rows.
+
+    :param scale_max: Fix the maximum of the shared scale. -- see scale_min.
+
+    Other keyword arguments (color_scheme, underline, overline, max_length,
+    reducer, scale, compact) are passed on to each row's SparkColumnWidget.
+    """
+
+    __slots__ = ("sparks", "scale_min", "scale_max", "widget_options", "scale")
+
+    def __init__(self, series,
+                 scale_min = None,
+                 scale_max = None,
+                 **kwargs):
+
+        self.scale_min = scale_min
+        self.scale_max = scale_max
+        self.widget_options = kwargs
+        self.scale = None
+
+        self.sparks = [ self._make_row() for items in series ]
+        for row, items in zip(self.sparks, series):
+            row._ingest(items)
+        self._update(range(len(self.sparks)))
+
+        super(SparkGroup, self).__init__(self.sparks)
+
+    def _make_row(self):
+
+        return SparkColumnWidget([],
+                                 scale_min = self.scale_min,
+                                 scale_max = self.scale_max,
+                                 **self.widget_options)
+
+    def add_series(self, items):
+        """
+        Add a row to the bottom of the group and return its index.
+        """
+
+        row = self._make_row()
+        row._ingest(items)
+        self.sparks.append(row)
+        self.contents.append((row, self.options()))
+        self._update([len(self.sparks) - 1])
+        return len(self.sparks) - 1
+
+    def append(self, index, item):
+        """
+        Add one item to the end of row index.
+        """
+
+        self.sparks[index]._push(item)
+        self._update([index])
+
+    def extend(self, index, items):
+        """
+        Add a sequence of items to the end of row index.
+        """
+
+        self.sparks[index]._ingest(items)
+        self._update([index])
+
+    def update(self, series):
+        """
+        Add items to several rows at once, rescaling no more than once.
+
+        :param series: A dictionary mapping row indexes to item sequences.
+        """
+
+        for index, items in series.items():
+            self.sparks[index]._ingest(items)
+        self._update(list(series.keys()))
+
+    def get_scale(self):
+        """
+        Return the (scale_min, scale_max) shared by all rows.
+        """
+
+        rows = [ row for row in self.sparks if row.values ]
+        return (
+            self.scale_min if self.scale_min is not None
+            else min(row.v_min for row in rows) if rows else None,
+            self.scale_max if self.scale_max is not None
+            else max(row.v_max for row in rows) if rows else None
+        )
+
+    def _update(self, indexes):
+
+        scale = self.get_scale()
+        if scale == self.scale:
+            for index in indexes:
+                self.sparks[index]._refresh()
+            return
+
+        self.scale = scale
+        for row in self.sparks:
+            row.scale_min, row.scale_max = scale
+
+        if None in scale or load_numpy() is None:
+            for row in self.sparks:
+                row._refresh()
+            return
+
+        # one quantization pass over every row's values
+        started = stats and time.perf_counter()
+        values = np.fromiter(
+            (v for row in self.sparks for v in row.values),
+            dtype=float,
+            count=sum(len(row.values) for row in self.sparks)
+        )
+        idx = SparkWidget.quantize(
+            values,
+            len(SparkColumnWidget.chars) * self.widget_options.get("height", 1),
+            scale[0], scale[1],
+            self.widget_options.get("scale", "linear")
+        )
+        if started and stats is not None:
+            stats.add_time(type(self).__name__, "quantize", started)
+            stats.add(type(self).__name__, "quantized", len(values))
+
+        start = 0
+        for row in self.sparks:
+            end = start + len(row.values)
+            row._requantize(values[start:end], idx[start:end])
+            start = end
+
+
+class UpdateScheduler(object):
+    """
+    Collects updates to spark widgets and applies them at most max_fps times
+    per second.
+
+    Samples queued with append() / extend() are gathered per widget and
+    applied with a single extend() (or SparkGroup.update()) on the next frame,
+    and functions queued with call() -- e.g. one that replaces a widget
+    outright, or updates a SparkBarWidget, which can't be added to -- run once
+    on the next frame, with a later call for the same key replacing an
+    earlier one.  A burst of updates thus costs one rebuild and one redraw
+    per frame.
+
+    :param loop: An urwid.MainLoop, whose set_alarm_in() is used to schedule
+    frames, or an urwid event loop such as urwid.AsyncioEventLoop, whose
+    alarm() is used.  Can also be set later through the loop attribute.
+
+    :param max_fps: Maximum number of frames per second.
+    """
+
+    def __init__(self, loop = None, max_fps = DEFAULT_MAX_FPS):
+
+        self.loop = loop
+        self.max_fps = max_fps
+        self.frames = 0
+        self._samples = collections.OrderedDict()
+        self._calls = collections.OrderedDict()
+        self._alarm = None
+        self._last_frame = None
+
+    @property
+    def pending(self):
+        """
+        True if there are updates waiting for the next frame.
+        """
+        return bool(self._samples or self._calls)
+
+    def append(self, target, item, index = None):
+        """
+        Queue one item to be added to target, a SparkColumnWidget, or row
+        index of target if it is a SparkGroup.
+        """
+        self._queue(target, index).append(item)
+        self._schedule()
+
+    def extend(self, target, items, index = None):
+        """
+        Queue a sequence of items to be added to target. -- see append().
+        """
+        self._queue(target, index).extend(items)
+        self._schedule()
+
+    def call(self, fn, key = None):
+        """
+        Run fn() on the next frame.  If key is given, a later call with the
+        same key replaces this one.
+        """
+        self._calls[key if key is not None else object()] = fn
+        self._schedule()
+
+    def _queue(self, target, index):
+
+        if isinstance(target, SparkGroup):
+            rows = self._samples.setdefault(target, collections.OrderedDict())
+            return rows.setdefault(index, [])
+        if not hasattr(target, "extend"):
+            # e.g. a SparkBarWidget, whose items are replaced rather than added to
+            raise Exception("Can't add items to %s, use call() to update it"
+                            %(type(target).__name__))
+        return self._samples.setdefault(target, [])
+
+    def _schedule(self):
+
+        if self._alarm is not None or self.loop is None:
+            return
+
+        delay = 0
+        if self._last_frame is not None and self.max_fps:
+            delay = max(0, self._last_frame + 1 / self.max_fps - time.monotonic())
+
+        if hasattr(self.loop, "set_alarm_in"):
+            self._alarm = self.loop.set_alarm_in(delay, self._on_alarm)
+        else:
+            self._alarm = self.loop.alarm(delay, self.flush)
+
+    def _on_alarm(self, loop, user_data = None):
+        self.flush()
+
+    def flush(self):
+        """
+        Apply all pending updates now.
+        """
+
+        if self._alarm is not None:
+            if self.loop is not None:
+                self.loop.remove_alarm(self._alarm)
+            self._alarm = None
+
+        samples, self._samples = self._samples, collections.OrderedDict()
+        calls, self._calls = self._calls, collections.OrderedDict()
+
+        for target, items in samples.items():
+            if isinstance(target, SparkGroup):
+                target.update(items)
+            else:
+                target.extend(items)
+
+        for fn in calls.values():
+            fn()
+
+        self._last_frame = time.monotonic()
+        self.frames += 1
+
+
+class SampleFeeder(object):
+    """
+    A thread-safe inlet for samples produced outside the urwid main loop.
+
+    Worker threads push() samples for a SparkColumnWidget, or a row of a
+    SparkGroup, into a bounded queue; once it holds max_pending samples the
+    oldest are dropped (and counted in dropped).  The first sample of a batch
+    wakes the main loop through a pipe from MainLoop.watch_pipe(), and the
+    main loop then takes everything pending in one go and applies it with a
+    single extend() per widget or update() per group, or passes it on to an
+    UpdateScheduler.  The main loop takes the lock once per batch rather than
+    once per sample.
+
+    :param loop: The urwid.MainLoop to wake.  Without one, call flush() from
+    the thread the widgets belong to.
+
+    :param max_pending: Maximum number of samples waiting to be applied, or
+    None for no limit.
+
+    :param scheduler: An UpdateScheduler to hand batches to, so that they are
+    applied on its next frame, instead of applying them straight away.
+    """
+
+    def __init__(self, loop = None, max_pending = FEEDER_MAX_PENDING,
+                 scheduler = None):
+
+        self.loop = loop
+        self.max_pending = max_pending
+        self.scheduler = scheduler
+        self.dropped = 0
+        self.batches = 0
+        self._queue = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._woken = False
+        self._wake_fd = None
+        if loop is not None:
+            self._wake_fd = loop.watch_pipe(self._on_wake)
+
+    @property
+    def pending(self):
+        """
+        The number of samples waiting to be applied.
+        """
+        return len(self._queue)
+
+    def push(self, target, item, index = None):
+        """
+        Queue one item for target, a SparkColumnWidget, or row index of target
+        if it is a SparkGroup.  Safe to call from any thread.
+        """
+        self.push_many(target, (item,), index)
+
+    def push_many(self, target, items, index = None):
+        """
+        Queue a sequence of items for target. -- see push().
+        """
+
+        with self._lock:
+            queue = self._queue
+            before = len(queue)
+            queue.extend([ (target, index, item) for item in items ])
+            self.dropped += before + len(items) - len(queue)
+            if not self._woken and self._wake_fd is not None:
+                self._woken = True
+                os.write(self._wake_fd, b"\0")
+
+    def _on_wake(self, data):
+
+        if not data:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        """
+        Apply all pending samples now.  Must be called from the thread the
+        widgets belong to, normally the one running the main loop.
+        """
+
+        with self._lock:
+            queue, self._queue = self._queue, deque(maxlen=self.max_pending)
+            self._woken = False
+
+        if not queue:
+            return
+
+        batches = collections.OrderedDict()
+        for (target, index, item) in queue:
+            batches.setdefault((target, index), []).append(item)
+
+        groups = collections.OrderedDict()
+        for (target, index), items in batches.items():
+            if self.scheduler is not None:
+                self.scheduler.extend(target, items, index)
+            elif isinstance(target, SparkGroup):
+                groups.setdefault(target, {})[index] = items
+            else:
+                target.extend(items)
+
+        for group, series in groups.items():
+            group.update(series)
+
+        self.batches += 1
+
+    def close(self):
+        """
+        Stop waking the main loop and close the pipe.
+        """
+
+        with self._lock:
+            fd, self._wake_fd = self._wake_fd, None
+        if fd is not None:
+            self.loop.remove_watch_pipe(fd)
+            os.close(fd)
+
+
+# ColorQuantizers snapping colors a terminal depth can't show, by depth
+_ansi_quantizers = {}
+
+
+def _ansi_quantizer(colors):
+
+    try:
+        return _ansi_quantizers[colors]
+    except KeyError:
+        pass
+    if colors == 88:
+        quantizer = ColorQuantizer(
+            urwid.display_common._BASIC_COLORS
+            + [ "h%d" %(i) for i in range(16, 88) ]
+        )
+    else:
+        quantizer = ColorQuantizer(16 if colors < 256 else 256)
+    _ansi_quantizers[colors] = quantizer
+    return quantizer
+
+
+@functools.lru_cache(maxsize=1024)
+def ansi_escape(attr, colors):
+    """
+    Return the ANSI escape sequence selecting an "fg" or "fg:bg" attribute
+    on a terminal with the given number of colors (16, 88, 256 or 2**24), or
+    None if attr is not made of color names.  Colors the terminal can't show,
+    e.g. "#ff8800" or "h200" on 16 colors, are drawn in the nearest color it
+    can (see ColorQuantizer).
+    """
+
+    (fg, _, bg) = attr.partition(":")
+    try:
+        spec = urwid.AttrSpec(fg, bg or "default", colors)
+    except urwid.AttrSpecError:
+        quantizer = _ansi_quantizer(colors)
+        try:
+            spec = urwid.AttrSpec(quantizer.nearest(fg),
+                                  quantizer.nearest(bg or "default"), colors)
+        except urwid.AttrSpecError:
+            return None
+
+    codes = []
+    for (true, high, basic, number, rgb, base, bright, default) in (
+            (spec.foreground_true, spec.foreground_high, spec.foreground_basic,
+             spec.foreground_number, spec.get_rgb_values()[0:3], 30, 90, 39),
+            (spec.background_true, spec.background_high, spec.background_basic,
+             spec.background_number, spec.get_rgb_values()[3:6], 40, 100, 49)):
+        if true:
+            codes.append("%d;2;%d;%d;%d" %((base + 8,) + tuple(rgb)))
+        elif high:
+            codes.append("%d;5;%d" %(base + 8, number))
+        elif basic:
+            codes.append("%d" %(number + base if number < 8 else number - 8 + bright))
+        else:
+            codes.append("%d" %(default))
+    return "\x1b[0;%sm" %(";".join(codes))
+
+
+def markup_to_text(markup, colors = None):
+    """
+    Return the text of markup as a string, with each attribute run wrapped in
+    ANSI escape sequences if colors (see ansi_escape()) is given.
+    """
+
+    if isinstance(markup, str):
+        return markup
+
+    text = []
+    for run in markup:
+        (attr, run) = run if isinstance(run, tuple) else (None, run)
+        escape = ansi_escape(attr, colors) if colors and attr else None
+        if escape:
+            text.append("\n".join([
+                "%s%s%s" %(escape, line, ANSI_RESET) if line else line
+                for line in run.split("\n")
+            ]))
+        else:
+            text.append(run)
+    return "".join(text)
+
+
+def render_text(items, kind = "column", width = None, colors = None, **kwargs):
+    """
+    Render a chart of items straight to a string, with no urwid screen.
+
+    :param kind: "column" for a SparkColumnWidget chart, "dot" for a
+    SparkDotWidget or "bar" for a SparkBarWidget.
+
+    :param width: The width of a bar chart, or the width a column chart with
+    a reducer is downsampled to.
+
+    :param colors: None for plain text, or the number of terminal colors to
+    write ANSI escape sequences for.
+
+    Other keyword arguments are passed on to the widget.
+    """
+
+    if kind == "bar":
+        widget = SparkBarWidget(items, width, **kwargs)
+    elif kind == "column":
+        widget = SparkColumnWidget(items, **kwargs)
+    elif kind == "dot":
+        widget = SparkDotWidget(items, **kwargs)
+    else:
+        raise Exception("Unknown chart kind: %s" %(kind))
+
+    size = (width or max(1, -(-len(items) // widget.per_cell)),)
+    return markup_to_text(widget.get_markup(size), colors)
+
+
+def _render_chunk(chunk):
+    # one worker process's share of render_many()
+
+    (series, kind, width, colors, kwargs) = chunk
+    return [ render_text(items, kind, width, colors, **kwargs) for items in series ]
+
+
+def render_many(series, kind = "column", width = None, colors = None,
+                processes = None, chunksize = RENDER_CHUNK_SIZE, **kwargs):
+    """
+    Render a sequence of item sequences with render_text(), returning a list
+    of strings in the same order.
+
+    :param processes: The number of worker processes to spread the series
+    across with a ProcessPoolExecutor.  None uses one per CPU; 0 or 1 renders
+    everything in this process.
+
+    :param chunksize: The number of series handed to a worker at a time.
+
+    Other arguments are as for render_text().  With processes, kwargs (such
+    as a "rules" color scheme or a reducer) must be picklable.
+    """
+
+    series = list(series)
+    chunks = [
+        (series[i:i + chunksize], kind, width, colors, kwargs)
+        for i in range(0, len(series), chunksize)
+    ]
+
+    if processes is not None and processes <= 1 or len(chunks) <= 1:
+        results = map(_render_chunk, chunks)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(_render_chunk, chunks))
+
+    return [ text for chunk in results for text in chunk ]
+
+
+# the public API, including the lazily imported urwid_utils names, for
+# "from urwid_sparkwidgets import *"
+__all__ = [
+    "SparkWidget", "SparkColumnWidget", "SparkDotWidget",
+    "SparkHistogramWidget", "SparkBarWidget", "SparkGroup", "SparkCanvas",
+    "UpdateScheduler", "SampleFeeder",
+    "PaletteRegistry", "RenderCache", "render_cache", "ColorQuantizer",
+    "QuantizationTable", "RuleTable", "Stats",
+    "load_numpy", "is_ndarray",
+    "get_palette_entry", "get_palette_entries", "get_label_color",
+    "color_luminance", "color_rgb", "get_quantization_table",
+    "compile_rules", "digest", "approx_size",
+    "enable_stats", "disable_stats", "get_stats", "reset_stats",
+    "reduce_mean", "reduce_max", "reduce_minmax", "reduce_lttb", "REDUCERS",
+    "ansi_escape", "markup_to_text", "render_text", "render_many",
+    "BLOCK_VERTICAL", "BLOCK_HORIZONTAL", "BRAILLE_CELLS", "QUADRANT_CELLS",
+    "DOT_STYLES", "VECTORIZE_THRESHOLD",
+    "DEFAULT_LABEL_COLOR", "DEFAULT_LABEL_COLOR_DARK",
+    "DEFAULT_LABEL_COLOR_LIGHT",
+    "DISTINCT_COLORS_16", "DISTINCT_COLORS_256", "DISTINCT_COLORS_TRUE",
+    "COLOR_SCHEMES", "NORMAL_MONO", "NORMAL_FG_16", "NORMAL_BG_16",
+    "NORMAL_FG_256", "NORMAL_BG_256", "OPERATOR_MAP",
+    "DEFAULT_MAX_FPS", "FEEDER_MAX_PENDING", "RENDER_CHUNK_SIZE",
+    "HISTOGRAM_BINS", "HISTOGRAM_PANES", "HISTOGRAM_MAX_WEIGHT", "ANSI_RESET",
+    "RENDER_CACHE_SIZE", "RENDER_CACHE_BYTES", "COMPACT_ATTR_LIMIT",
+    "SYMLOG_LINTHRESH",
+    "RULES_CACHE_SIZE", "PALETTE_CACHE_SIZE", "PALETTE_NAMES"
+] + list(PALETTE_NAMES)
@@ -7,73 +7,72 @@ from itertools import chain, repeat, islice
 from urwid_sparkwidgets import *
 
 
-screen = urwid.raw_display.Screen()
-screen.set_terminal_properties(1<<24)
-
 LABEL_COLOR_DARK = "black"
 LABEL_COLOR_LIGHT = "white"
 
-entries = {}
-
-
 all_colors = [ urwid.display_common._color_desc_256(x)
                    for x in range(32,224) ]
 random_colors = [ random.choice(all_colors) for i in range(16) ]
 
 label_colors = [ LABEL_COLOR_DARK, LABEL_COLOR_LIGHT ]
 
-entries.update(
-    get_palette_entries(
-        label_colors = label_colors
-    )
-)
 
-entries.update(
-    get_palette_entries(
-        chart_colors = random_colors,
-        label_colors = label_colors
-    )
-)
+def get_palette():
 
+    entries = {}
 
-for fcolor in random_colors + label_colors:
+    entries.update(
+        get_palette_entries(
+            label_colors = label_colors
+        )
+    )
+
+    entries.update(
+        get_palette_entries(
+            chart_colors = random_colors,
+            label_colors = label_colors
+        )
+    )
 
-    entries.update({
-        fcolor: PaletteEntry(
-            mono = "white",
-            foreground = (fcolor
-                          if fcolor in urwid.display_common._BASIC_COLORS
-                          else "white"),
-            background = "black",
-            foreground_high = fcolor,
-            background_high = "black"
-        ),
-    })
 
-    for bcolor in random_colors:
+    for fcolor in random_colors + label_colors:
 
         entries.update({
-            "%s:%s" %(fcolor, bcolor): PaletteEntry(
+            fcolor: PaletteEntry(
                 mono = "white",
                 foreground = (fcolor
                               if fcolor in urwid.display_common._BASIC_COLORS
                               else "white"),
-                background = (bcolor
-                              if bcolor in urwid.display_common._BASIC_COLORS
-                              else "black"),
+                background = "black",
                 foreground_high = fcolor,
-                background_high = bcolor
+                background_high = "black"
             ),
         })
 
+        for bcolor in random_colors:
+
+            entries.update({
+                "%s:%s" %(fcolor, bcolor): PaletteEntry(
+                    mono = "white",
+                    foreground = (fcolor
+                                  if fcolor in urwid.display_common._BASIC_COLORS
+                                  else "white"),
+                    background = (bcolor
+                                  if bcolor in urwid.display_common._BASIC_COLORS
+                                  else "black"),
+                    foreground_high = fcolor,
+                    background_high = bcolor
+                ),
+            })
+
+    # raise Exception(entries)
+    return Palette("default", **entries)
+
 
 def intersperse(delimiter, seq):
     return islice(chain.from_iterable(zip(repeat(delimiter), seq)), 1, None)
 
 
-# raise Exception(entries)
-palette = Palette("default", **entries)
-
 spark1 = urwid.Filler(SparkColumnWidget(list(range(0, 8))))
 spark2 = urwid.Filler(SparkColumnWidget(list(range(0, 100)), color_scheme="rotate_16", scale_min=20, scale_max=90))
 spark3 = urwid.Filler(SparkColumnWidget([5*random.random() for i in range(0, 100)], color_scheme="rotate_true"))
@@ -178,9 +177,12 @@ def main():
             return key
 
 
+    screen = urwid.raw_display.Screen()
+    screen.set_terminal_properties(1<<24)
+
     loop = urwid.MainLoop(
         pile,
-        palette = palette,
+        palette = get_palette(),
         screen = screen,
         unhandled_input = keypress
     )